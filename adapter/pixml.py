@@ -17,6 +17,11 @@ import re
 import os
 import glob
 
+from timeseries import pidates
+from timeseries import piparse
+from timeseries.pitags import local_names
+from timeseries import windows
+
 TAG_START = 'startDate'
 TAG_END = 'endDate'
 TAG_STEP = 'timeStep'
@@ -24,6 +29,11 @@ TAG_MISSVAL = 'missVal'
 TAG_PARAMETER_ID = 'parameterId'
 
 
+def _microseconds(delta):
+    """ Return timedelta delta as a whole number of microseconds. """
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+
+
 class Series(object):
     """
     like etree, but:
@@ -107,11 +117,77 @@ class Series(object):
     def _datetime_from_index(self, index):
         return self.start + index * self.step
 
+    def rolling(self, window, how='sum', min_count=None):
+        """
+        Return a new series of how over a trailing window.
+
+        The window is a number of steps or a timedelta, how is one of
+        'sum', 'mean', 'min', 'max' and 'count'. A timedelta is rounded
+        down to a whole number of steps, and a ValueError is raised if
+        that leaves less than one step. Masked values are left out;
+        values whose window holds less than min_count unmasked values
+        are masked. As for TimeSeries.rolling, min_count defaults to a
+        full window for a number of steps and to 1 for a timedelta.
+
+        The cost is linear in the length of the series, whatever the
+        width of the window.
+        """
+        values, starts, min_count = self._window(window, min_count)
+        return self._windowed(
+            windows.rolling(values, starts, how, min_count),
+        )
+
+    def rolling_percentile(self, window, percentile, min_count=None):
+        """
+        Return a new series of a percentile over a trailing window.
+
+        Window and min_count are as for rolling, the percentile is in
+        [0, 100] and interpolated as by np.percentile. The window is kept
+        sorted in two heaps, so each step costs time logarithmic in the
+        width of the window.
+        """
+        values, starts, min_count = self._window(window, min_count)
+        return self._windowed(
+            windows.rolling_percentile(values, starts, percentile, min_count),
+        )
+
+    def _window(self, window, min_count):
+        """ Return values, window starts and min_count for rolling. """
+        if isinstance(window, datetime.timedelta):
+            duration = window
+            window = _microseconds(duration) // _microseconds(self.step)
+            if window < 1:
+                raise ValueError(
+                    'window {} is shorter than the step {}'.format(
+                        duration, self.step,
+                    )
+                )
+            if min_count is None:
+                min_count = 1
+        elif window < 1:
+            raise ValueError(
+                'window of {} steps, at least 1 is needed'.format(window),
+            )
+        if min_count is None:
+            min_count = window
+        values = self.ma.astype(np.float64).filled(np.nan)
+        starts = windows.starts_by_count(values.size, window)
+        return values, starts, min_count
+
+    def _windowed(self, result):
+        """ Return a copy of this series holding result, masked where nan. """
+        return Series(tree=copy.deepcopy(self.tree),
+                      start=self.start,
+                      end=self.end,
+                      step=self.step,
+                      ma=np.ma.masked_invalid(result),
+                      missval=self.missval)
+
     # Methods to facilitate modifying tree elements
     def _get_tree_element(self, tag):
         """ Get attrib of element with tag in tree. """
         for element in self.tree.iter():
-            if element.tag.endswith(tag):
+            if local_names[element.tag] == tag:
                 return element
 
     def _set_tree_value(self, tag, value):
@@ -192,8 +268,13 @@ class Series(object):
 
 class SeriesReader(object):
 
-    def __init__(self, xml_input_path):
+    def __init__(self, xml_input_path, parser=None):
+        """
+        The parser names the XML parser, one of piparse.PARSERS. By
+        default, the fastest available one is used.
+        """
         self.xml_input_path = xml_input_path
+        self.parser = parser
 
         bin_input_path =  re.sub('xml$','bin', xml_input_path)
         if os.path.exists(bin_input_path):
@@ -203,15 +284,12 @@ class SeriesReader(object):
             self.bin_input_path = None
             self.binary = False
 
+        # Dates and times repeat over the file, parse each only once.
+        self._datetime_parser = pidates.DateTimeParser()
+
     def _datetime_from_elem(self, elem):
         """ Return python datetime object. """
-        return datetime.datetime.strptime(
-            '{date} {time}'.format(
-                date=elem.attrib['date'],
-                time=elem.attrib['time'],
-            ),
-            '%Y-%m-%d %H:%M:%S',
-        )
+        return self._datetime_parser(elem.attrib['date'], elem.attrib['time'])
 
     def _set_values(self, series, inputfile):
         """ Set series values from binary inputfile. """
@@ -247,10 +325,13 @@ class SeriesReader(object):
         necessarily in sync with the events returned by iterparse.
 
         Therefore we keep a copy of selected elements of the tree that
-        is used to instantiate the series.
+        is used to instantiate the series. The copies are ElementTree
+        elements, whatever the parser.
         """
-        iterator = iter(ElementTree.iterparse(
+        iterator = iter(piparse.iterparse(
             self.xml_input_path, events=('start', 'end'),
+            tags=('TimeSeries', 'timeZone', 'series', 'header', 'event'),
+            parser=self.parser,
         ))
         if self.binary:
             bin_input_file = open(self.bin_input_path, 'rb')
@@ -264,37 +345,38 @@ class SeriesReader(object):
         wildtree = None
 
         for parse_event, elem in iterator:
+            tag = local_names[elem.tag]
             # At the end of an event, write it to current result
-            if parse_event == 'end' and elem.tag.endswith('event'):
+            if parse_event == 'end' and tag == 'event':
                 dt = self._datetime_from_elem(elem)
                 value = float(elem.attrib['value'])
                 if value != result.missval:
                     result[dt] = value
                 wildseries.remove(elem)
             # Instantiate a new result when the header is complete
-            elif parse_event == 'end' and elem.tag.endswith('header'):
-                series.append(copy.deepcopy(elem))
+            elif parse_event == 'end' and tag == 'header':
+                series.append(piparse.copy_element(elem))
                 result = Series(tree=copy.deepcopy(tree))
                 if self.binary:
                     self._set_values(series=result, inputfile=bin_input_file)
             # After the series is completed, yield the result object.
-            elif parse_event == 'end' and elem.tag.endswith('series'):
+            elif parse_event == 'end' and tag == 'series':
                 yield result
                 wildtree.remove(wildseries)
                 tree.remove(series)
             # New series. Copy to series, remove unwanted children.
-            elif parse_event == 'start' and elem.tag.endswith('series'):
+            elif parse_event == 'start' and tag == 'series':
                 wildseries = elem
-                series = copy.deepcopy(elem)
+                series = piparse.copy_element(elem)
                 tree.append(series)
                 map(series.remove, series.getchildren()[:])
             # Timezone should be in the copy of the tree
-            elif parse_event == 'end' and elem.tag.endswith('timeZone'):
-                tree.append(copy.deepcopy(elem))
-            elif parse_event == 'start' and elem.tag.endswith('TimeSeries'):
+            elif parse_event == 'end' and tag == 'timeZone':
+                tree.append(piparse.copy_element(elem))
+            elif parse_event == 'start' and tag == 'TimeSeries':
             # New timeseries, make a copy and keep that copy nice and tidy.
                 wildtree = elem
-                tree = copy.deepcopy(elem)
+                tree = piparse.copy_element(elem)
                 map(tree.remove, tree.getchildren()[:])
 
         if self.binary:
@@ -328,7 +410,7 @@ class SeriesWriter(object):
 
     def _remove_namespace(self, tree):
         for element in tree.iter():
-            element.tag = re.sub('{.*}', '', element.tag)
+            element.tag = local_names[element.tag]
 
     def _write_tree(self, tree, begin=None, end=None, indent=0):
         """
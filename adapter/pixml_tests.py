@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+
+from datetime import datetime
+from datetime import timedelta
+from unittest import TestCase
+from xml.etree import ElementTree
+
+import numpy as np
+
+from pixml import Series
+
+
+HEADER = '''\
+<TimeSeries xmlns="http://www.wldelft.nl/fews/PI">
+  <series>
+    <header>
+      <type>instantaneous</type>
+      <locationId>loc</locationId>
+      <parameterId>par</parameterId>
+      <timeStep unit="second" multiplier="3600"/>
+      <startDate date="2010-01-01" time="00:00:00"/>
+      <endDate date="2010-01-01" time="05:00:00"/>
+      <missVal>-999.0</missVal>
+    </header>
+  </series>
+</TimeSeries>'''
+
+
+def hourly_series(values):
+    """return an hourly Series of values, masked where None"""
+    series = Series(tree=ElementTree.fromstring(HEADER))
+    for i, value in enumerate(values):
+        if value is not None:
+            series[i] = value
+    return series
+
+
+class SeriesRolling(TestCase):
+
+    def setUp(self):
+        self.series = hourly_series([1.0, 2.0, None, 4.0, 3.0, 5.0])
+
+    def test000(self):
+        'rolling over a number of steps masks windows that are not full'
+        result = self.series.rolling(2)
+        self.assertEquals([None, 3.0, None, None, 7.0, 8.0],
+                          result.ma.tolist())
+
+    def test010(self):
+        'rolling leaves masked values out of windows of min_count values'
+        result = self.series.rolling(2, how='mean', min_count=1)
+        self.assertEquals([1.0, 1.5, 2.0, 4.0, 3.5, 4.0],
+                          result.ma.tolist())
+
+    def test020(self):
+        'rolling over a timedelta takes that many steps'
+        expected = self.series.rolling(3, how='max', min_count=2)
+        current = self.series.rolling(timedelta(hours=3), how='max',
+                                      min_count=2)
+        self.assertEquals(expected.ma.tolist(), current.ma.tolist())
+        self.assertEquals([None, 2.0, 2.0, 4.0, 4.0, 5.0],
+                          current.ma.tolist())
+
+    def test030(self):
+        'rolling rounds a timedelta down to a whole number of steps'
+        expected = self.series.rolling(2, how='sum', min_count=1)
+        current = self.series.rolling(timedelta(minutes=150), how='sum',
+                                      min_count=1)
+        self.assertEquals(expected.ma.tolist(), current.ma.tolist())
+
+    def test040(self):
+        'rolling rejects a timedelta shorter than one step'
+        self.assertRaises(ValueError, self.series.rolling,
+                          timedelta(minutes=30))
+
+    def test050(self):
+        'rolling rejects a window of less than one step'
+        self.assertRaises(ValueError, self.series.rolling, 0)
+
+    def test060(self):
+        'rolling keeps the header of the series'
+        result = self.series.rolling(2)
+        self.assertEquals(self.series.start, result.start)
+        self.assertEquals(self.series.step, result.step)
+        self.assertEquals(datetime(2010, 1, 1, 5), result.end)
+
+    def test070(self):
+        'rolling over a timedelta needs one value by default'
+        result = self.series.rolling(timedelta(hours=2))
+        self.assertEquals([1.0, 3.0, 2.0, 4.0, 7.0, 8.0],
+                          result.ma.tolist())
+
+
+class SeriesRollingPercentile(TestCase):
+
+    def setUp(self):
+        self.values = [5.0, 1.0, None, 3.0, None, 4.0]
+        self.series = hourly_series(self.values)
+
+    def expected(self, width, percentile):
+        """return the percentiles of the windows of width steps"""
+        result = []
+        for i in range(len(self.values)):
+            window = [value for value in self.values[max(0, i - width + 1):
+                                                     i + 1]
+                      if value is not None]
+            result.append(float(np.percentile(window, percentile)))
+        return result
+
+    def test000(self):
+        'rolling_percentile agrees with np.percentile over masked values'
+        for percentile in (0, 25, 50, 90, 100):
+            result = self.series.rolling_percentile(3, percentile,
+                                                    min_count=1)
+            np.testing.assert_allclose(self.expected(3, percentile),
+                                       result.ma.tolist())
+
+    def test010(self):
+        'rolling_percentile over a timedelta needs one value by default'
+        expected = self.series.rolling_percentile(3, 50, min_count=1)
+        current = self.series.rolling_percentile(timedelta(hours=3), 50)
+        self.assertEquals(expected.ma.tolist(), current.ma.tolist())
+
+    def test020(self):
+        'rolling_percentile masks windows with less than min_count values'
+        result = self.series.rolling_percentile(3, 50)
+        self.assertEquals([None, None, None, None, None, None],
+                          result.ma.tolist())
+        result = self.series.rolling_percentile(3, 50, min_count=2)
+        self.assertEquals([None, 3.0, 3.0, 2.0, None, 3.5],
+                          result.ma.tolist())
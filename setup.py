@@ -13,6 +13,7 @@ install_requires = [
     'pkginfo',
     'setuptools',
     'nens',
+    'numpy',
     ],
 
 tests_require = [
@@ -34,7 +35,7 @@ setup(name='timeseries',
       zip_safe=False,
       install_requires=install_requires,
       tests_require=tests_require,
-      extras_require = {'test': tests_require},
+      extras_require = {'test': tests_require, 'lxml': ['lxml']},
       entry_points={
           'console_scripts': [
               'ziprelease = adapter.ziprelease:main',
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+
+"""calendar periods over arrays of timestamps
+
+timestamps are binned by the start of their period in one numpy
+conversion, and values are reduced per bin with segment reductions
+(`reduceat`), so that no datetime object is built per event.
+"""
+
+import numpy as np
+
+
+## the supported periods, from short to long.  the hydrological year
+## starts on the first of October.
+PERIODS = ('day', 'month', 'quarter', 'hydro_year', 'year')
+
+
+def period_starts(stamps, period):
+    """return the start of the period of each of `stamps`
+
+    `stamps` holds numpy datetime64, datetime objects or int64
+    microseconds since 1970-01-01.  the result is a datetime64[us]
+    array.
+
+    >>> stamps = np.array(['1999-09-02T03:04', '1999-10-02'],
+    ...                   dtype='datetime64[us]')
+    >>> period_starts(stamps, 'quarter').astype(object).tolist()
+    [datetime.datetime(1999, 7, 1, 0, 0), datetime.datetime(1999, 10, 1, 0, 0)]
+    >>> period_starts(stamps, 'hydro_year').astype(object).tolist()
+    [datetime.datetime(1998, 10, 1, 0, 0), datetime.datetime(1999, 10, 1, 0, 0)]
+    """
+
+    assert period in PERIODS
+    stamps = np.asarray(stamps)
+    if stamps.dtype.kind != 'M':
+        stamps = stamps.astype('datetime64[us]')
+    if period == 'day':
+        starts = stamps.astype('datetime64[D]')
+    elif period == 'year':
+        starts = stamps.astype('datetime64[Y]')
+    else:
+        ## months since January 1970, rounded down to the first month
+        ## of the quarter or of the hydrological year (October).
+        months = stamps.astype('datetime64[M]').astype(np.int64)
+        if period == 'quarter':
+            months -= months % 3
+        elif period == 'hydro_year':
+            months -= (months - 9) % 12
+        starts = months.astype('datetime64[M]')
+    return starts.astype('datetime64[us]')
+
+
+def segments(starts):
+    """return (keys, edges) of the runs of equal `starts`
+
+    `keys` holds the value of each run, `edges` the index where it
+    begins, as taken by `reduceat`.
+    """
+
+    if not len(starts):
+        return starts, np.zeros(0, dtype=np.intp)
+    edges = np.flatnonzero(np.concatenate(([True],
+                                           starts[1:] != starts[:-1])))
+    return starts[edges], edges
+
+
+def reduce_segments(values, edges, how):
+    """reduce `values` over the segments beginning at `edges`
+
+    `how` is one of 'sum', 'mean', 'min', 'max' and 'count'.  missing
+    (nan) values are left out; the mean, min and max of a segment
+    without values are nan.
+    """
+
+    assert how in ('sum', 'mean', 'min', 'max', 'count')
+    values = np.asarray(values, dtype=np.float64)
+    if not len(edges):
+        return np.zeros(0, dtype=np.float64)
+    missing = np.isnan(values)
+    counts = np.add.reduceat((~missing).astype(np.int64), edges)
+    if how == 'count':
+        return counts.astype(np.float64)
+    if how in ('sum', 'mean'):
+        result = np.add.reduceat(np.where(missing, 0.0, values), edges)
+        if how == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result = result / counts
+        return result
+    if how == 'min':
+        result = np.minimum.reduceat(np.where(missing, np.inf, values),
+                                     edges)
+    else:
+        result = np.maximum.reduceat(np.where(missing, -np.inf, values),
+                                     edges)
+    result[counts == 0] = np.nan
+    return result
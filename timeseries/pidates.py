@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+
+"""dates and times as written in PI files
+
+PI files write every event with a `date` in YYYY-mm-dd and a `time` in
+HH:MM:SS layout.  these fields are read by slicing the strings, which
+is much cheaper than `datetime.strptime`; anything else falls back to
+`strptime`, so that it is rejected with the same ValueError.
+"""
+
+from datetime import datetime
+from datetime import timedelta
+
+import numpy as np
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def parse_date_time(date, time):
+    """return the datetime of PI `date` and `time` strings
+
+    >>> parse_date_time('2010-04-03', '12:30:05')
+    datetime.datetime(2010, 4, 3, 12, 30, 5)
+    >>> parse_date_time('2010-4-3', '12:30:05')
+    datetime.datetime(2010, 4, 3, 12, 30, 5)
+    """
+
+    if len(date) == 10 and len(time) == 8:
+        try:
+            return datetime(int(date[0:4]), int(date[5:7]), int(date[8:10]),
+                            int(time[0:2]), int(time[3:5]), int(time[6:8]))
+        except ValueError:
+            pass
+    return datetime.strptime(date + 'T' + time, "%Y-%m-%dT%H:%M:%S")
+
+
+class DateTimeParser(object):
+    """functor class, reading the date and time of the events of a file
+
+    given the `date` and `time` strings of an event, return its
+    datetime, `offset` hours from UTC.  every distinct date and time
+    string is parsed once: a file holds few of them, repeated over
+    many events, so most events cost two dictionary lookups.
+
+    >>> parser = DateTimeParser(1)
+    >>> parser('2010-04-03', '00:30:00')
+    datetime.datetime(2010, 4, 2, 23, 30)
+    """
+
+    def __init__(self, offset=0):
+        self.offset = timedelta(0, offset * 3600)
+        self._dates = {}
+        self._times = {}
+
+    def __call__(self, date, time):
+        try:
+            return self._dates[date] + self._times[time]
+        except KeyError:
+            pass
+        if date not in self._dates:
+            self._dates[date] = (parse_date_time(date, '00:00:00') -
+                                 self.offset)
+        if time not in self._times:
+            self._times[time] = parse_date_time('1970-01-01', time) - EPOCH
+        return self._dates[date] + self._times[time]
+
+
+def to_datetime64(dates, times, offset=0):
+    """return PI `dates` and `times` as one datetime64[us] array
+
+    all strings are converted by numpy in one call.  if numpy does not
+    take them, for example dates without zero padding, they are read
+    one by one, as `parse_date_time` does.
+
+    >>> to_datetime64(['2010-04-03', '2010-04-03'],
+    ...               ['00:00:00', '01:30:00'], 1).tolist()
+    [datetime.datetime(2010, 4, 2, 23, 0), datetime.datetime(2010, 4, 3, 0, 30)]
+    >>> to_datetime64(['2010-4-3'], ['01:30:00']).tolist()
+    [datetime.datetime(2010, 4, 3, 1, 30)]
+    """
+
+    try:
+        stamps = np.array([date + 'T' + time
+                           for date, time in zip(dates, times)],
+                          dtype='datetime64[us]')
+    except ValueError:
+        parser = DateTimeParser(offset)
+        return np.array([parser(date, time)
+                         for date, time in zip(dates, times)],
+                        dtype='datetime64[us]')
+    if offset:
+        stamps -= np.timedelta64(int(round(offset * 3600 * 10 ** 6)), 'us')
+    return stamps
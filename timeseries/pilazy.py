@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+
+"""PI files read one series at a time
+
+the file is scanned once for the byte offsets of its `series`
+elements, and only their headers are parsed.  the events of a series
+are parsed the first time it is asked for, from its own bytes: they
+are wrapped in the beginning of the file (up to the first series,
+holding the root element with its namespaces and the `timeZone`) and
+read as a PI file of one series.
+"""
+
+from collections import Mapping
+from StringIO import StringIO
+import mmap
+import re
+
+from timeseries import TimeSeries
+
+
+## comments and CDATA sections, matched first so that the tags in
+## them are passed over.
+_SKIPPED = r'<!--.*?-->|<!\[CDATA\[.*?\]\]>|'
+
+## the root element, and the beginning and end of series and headers,
+## with or without a namespace prefix.
+_ROOT = re.compile(_SKIPPED + r'<(?![?!])([^\s/>]+)', re.S)
+_SERIES = re.compile(_SKIPPED + r'<(/?)((?:[\w.-]+:)?series)(?=[\s>])',
+                     re.S)
+_HEADER_END = re.compile(_SKIPPED + r'</((?:[\w.-]+:)?header)\s*>', re.S)
+
+
+def _tags(pattern, content, start=0, end=None):
+    """iterate over the matches of `pattern` outside comments and CDATA
+
+    the last group of `pattern` holds the name of the tag.
+
+    >>> content = '<!-- <a> --><![CDATA[<a>]]><a>'
+    >>> [match.start() for match in _tags(_ROOT, content)]
+    [27]
+    """
+
+    if end is None:
+        end = len(content)
+    for match in pattern.finditer(content, start, end):
+        if match.group(pattern.groups) is not None:
+            yield match
+
+
+def _first(pattern, content, start=0, end=None):
+    """return the first match of `_tags`, or None
+    """
+
+    for match in _tags(pattern, content, start, end):
+        return match
+    return None
+
+
+class LazySeriesDict(Mapping):
+    """the TimeSeries of a PI file, read when they are first asked for
+
+    a read only dictionary from location_id/parameter_id to TimeSeries,
+    as returned by TimeSeries.as_dict.  `storage` and `parser` are as
+    for as_dict.  the file stays open until `close` is called, or the
+    dictionary is left as a context manager.
+    """
+
+    def __init__(self, input, storage=None, parser=None):
+        self.storage = storage
+        self.parser = parser
+        if hasattr(input, 'read'):
+            self._stream = input
+        else:
+            self._stream = open(input, 'rb')
+        self._series = {}
+        self._headers = {}
+        self._offsets = {}
+        try:
+            self._index()
+        except:
+            if self._stream is not input:
+                self._stream.close()
+            raise
+
+    def _index(self):
+        """find the series of the file, and read their headers
+        """
+
+        self._stream.seek(0)
+        content = None
+        if hasattr(self._stream, 'fileno'):
+            try:
+                content = mmap.mmap(self._stream.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                ## an empty file, or a stream that can not be mapped.
+                pass
+        if content is None:
+            content = self._stream.read()
+        try:
+            series = _first(_SERIES, content)
+            if series is None:
+                return
+            self._prefix = content[:series.start()]
+            self._suffix = '</%s>' % _first(_ROOT, self._prefix).group(1)
+            start = None
+            number = 0
+            for match in _tags(_SERIES, content, series.start()):
+                if not match.group(1):
+                    start = match.start()
+                    number += 1
+                    continue
+                end = content.find('>', match.end()) + 1
+                header = _first(_HEADER_END, content, start, end)
+                if header is None:
+                    raise ValueError("series %d, at byte %d, has no "
+                                     "complete header" % (number, start))
+                header = self._read(content[start:header.end()] +
+                                    '</%s>' % match.group(2))
+                for key, obj in header.items():
+                    self._headers[key] = obj
+                    self._offsets[key] = (start, end)
+        finally:
+            if isinstance(content, mmap.mmap):
+                content.close()
+
+    def _read(self, series):
+        """return the as_dict of the bytes of `series` elements
+        """
+
+        return TimeSeries.as_dict(
+            StringIO(self._prefix + series + self._suffix),
+            storage=self.storage, parser=self.parser)
+
+    def header(self, key):
+        """return a TimeSeries without events, holding the header of `key`
+        """
+
+        return self._headers[key]
+
+    def __getitem__(self, key):
+        if key not in self._series:
+            start, end = self._offsets[key]
+            self._stream.seek(start)
+            self._series[key] = self._read(
+                self._stream.read(end - start))[key]
+        return self._series[key]
+
+    def __contains__(self, key):
+        return key in self._headers
+
+    def __iter__(self):
+        return iter(self._headers)
+
+    def __len__(self):
+        return len(self._headers)
+
+    def close(self):
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+
+"""parsers of PI files
+
+PI files are read incrementally with `iterparse`, by one of these
+parsers, from fastest to slowest:
+
+ 'lxml'
+   `lxml.etree`, if it is installed.  only the elements asked for are
+   reported, the filtering is done in C.
+ 'cElementTree'
+   the C implementation of ElementTree of the standard library.
+ 'ElementTree'
+   the Python implementation of ElementTree.
+
+the parser is chosen by name, or else the fastest available one is
+taken.  all of them report the same events.
+"""
+
+from xml.etree import ElementTree
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+try:
+    from xml.etree import cElementTree
+except ImportError:
+    cElementTree = None
+
+from pitags import local_names
+
+
+PARSERS = ('lxml', 'cElementTree', 'ElementTree')
+
+_modules = {'lxml': lxml_etree,
+            'cElementTree': cElementTree,
+            'ElementTree': ElementTree,
+            }
+
+
+def available_parsers():
+    """return the names of the parsers that can be used, fastest first
+    """
+
+    return [name for name in PARSERS if _modules[name] is not None]
+
+
+def iterparse(source, events=('end',), tags=None, parser=None):
+    """iterate over the (event, element) pairs of XML `source`
+
+    `source` is a file name or an open file.  `events` are as for
+    `ElementTree.iterparse`; if `tags` is given, only elements with
+    these names, in any namespace, are reported.  `parser` names one
+    of PARSERS, by default the fastest one available.
+    """
+
+    if parser is None:
+        parser = available_parsers()[0]
+    assert parser in PARSERS
+    module = _modules[parser]
+    if module is None:
+        raise ValueError("parser %s is not available" % parser)
+    ## cElementTree takes no unicode event names.
+    events = tuple(str(event) for event in events)
+
+    if parser == 'lxml':
+        kwargs = {'remove_comments': True, 'remove_pis': True}
+        if tags is not None:
+            kwargs['tag'] = ['{*}' + tag for tag in tags]
+        return module.iterparse(source, events, **kwargs)
+
+    result = module.iterparse(source, events)
+    if tags is not None:
+        tags = frozenset(tags)
+        result = ((event, element) for (event, element) in result
+                  if local_names[element.tag] in tags)
+    return result
+
+
+def copy_element(element):
+    """return a deep copy of `element` as an ElementTree element
+
+    `element` may come from any of the parsers.
+
+    >>> element = ElementTree.fromstring('<a x="1"><b>text</b>tail</a>')
+    >>> ElementTree.tostring(copy_element(element))
+    '<a x="1"><b>text</b>tail</a>'
+    """
+
+    result = ElementTree.Element(element.tag, dict(element.attrib))
+    result.text = element.text
+    result.tail = element.tail
+    result.extend(copy_element(child) for child in element)
+    return result
@@ -0,0 +1,39 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+
+"""element tags of PI files without their namespace
+
+ElementTree gives tags as '{namespace}name'.  `local_names` maps such a
+tag to its name: the tags of the PI namespace are in it from the
+start, any other tag is added the first time it is looked up, so that
+no tag is stripped twice.
+"""
+
+PI_NAMESPACE = 'http://www.wldelft.nl/fews/PI'
+
+## the elements of PI time series files.
+PI_TAGS = ('TimeSeries', 'timeZone', 'series', 'header', 'type',
+           'locationId', 'parameterId', 'timeStep', 'startDate', 'endDate',
+           'missVal', 'stationName', 'lat', 'lon', 'x', 'y', 'z', 'units',
+           'event', 'comment')
+
+
+class LocalNames(dict):
+    """dictionary from tag to name without namespace
+
+    >>> names = LocalNames()
+    >>> names['{http://www.wldelft.nl/fews/PI}series']
+    'series'
+    >>> names['event']
+    'event'
+    """
+
+    def __missing__(self, tag):
+        name = self[tag] = tag[tag.rfind('}') + 1:]
+        return name
+
+
+local_names = LocalNames(('{%s}%s' % (PI_NAMESPACE, name), name)
+                         for name in PI_TAGS)
+local_names.update((name, name) for name in PI_TAGS)
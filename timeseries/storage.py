@@ -0,0 +1,1399 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+
+"""storage engines for the events of a TimeSeries
+
+a TimeSeries associates each timestamp to a (value, flag, comment)
+event.  any object offering the mapping interface used by TimeSeries
+can hold these events; the engines are registered in ENGINES and are
+selected by name through the `storage` keyword of TimeSeries.
+"""
+
+from bisect import bisect_left
+from bisect import bisect_right
+from collections import MutableMapping
+from datetime import datetime
+from datetime import timedelta
+from numbers import Real
+import weakref
+
+import numpy as np
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def datetime_to_epoch(timestamp):
+    """return amount of microseconds from EPOCH to `timestamp`
+
+    >>> datetime_to_epoch(datetime(1970, 1, 2, 0, 0, 1))
+    86401000000
+    """
+
+    delta = timestamp - EPOCH
+    return ((delta.days * 86400 + delta.seconds) * 1000000 +
+            delta.microseconds)
+
+
+def epoch_to_datetime(epoch):
+    """inverse of datetime_to_epoch
+
+    >>> epoch_to_datetime(86401000000)
+    datetime.datetime(1970, 1, 2, 0, 0, 1)
+    """
+
+    return EPOCH + timedelta(microseconds=int(epoch))
+
+
+def datetimes_to_epochs(timestamps):
+    """vectorized datetime_to_epoch, return int64 array
+    """
+
+    return np.array(timestamps, dtype='datetime64[us]').astype(np.int64)
+
+
+def epochs_to_datetimes(epochs):
+    """vectorized epoch_to_datetime, return list of datetime objects
+    """
+
+    epochs = np.asarray(epochs, dtype=np.int64)
+    return epochs.astype('datetime64[us]').astype(object).tolist()
+
+
+def as_epochs(timestamps):
+    """return `timestamps` as int64 microseconds since EPOCH
+
+    int64 arrays are taken as they are, without copying; numpy
+    datetime64 arrays are converted, anything else is read as a
+    sequence of datetimes.
+    """
+
+    timestamps = np.asarray(timestamps)
+    if timestamps.dtype == np.int64:
+        return timestamps
+    if timestamps.dtype.kind == 'M':
+        return timestamps.astype('datetime64[us]').view(np.int64)
+    return datetimes_to_epochs(timestamps)
+
+
+def _read_only(array):
+    """return a read-only view on `array`
+    """
+
+    result = array.view()
+    result.flags.writeable = False
+    return result
+
+
+def _columns(stamps, values, flags):
+    """return read-only int64, float64 and int8 copies of the columns
+    """
+
+    return (_read_only(np.array(stamps, dtype=np.int64)),
+            _read_only(np.array(values, dtype=np.float64)),
+            _read_only(np.array(flags, dtype=np.int8)))
+
+
+def _as_event(event):
+    """return `event` as (value, flag, comment) tuple
+    """
+
+    if not isinstance(event, tuple):
+        return event, 0, ''
+    return event
+
+
+class EventDict(dict):
+    """dict of events, keeping a cached sorted index of its keys
+
+    keys added in chronological order extend the index, keys removed
+    are taken out of it, any other change drops the index so that it
+    is rebuilt the next time it is asked for.
+
+    the first and last keys are kept the same way: extended on insert,
+    recomputed lazily after one of them is removed.  the column arrays
+    are cached until the next change.
+
+    copies share the events with the original until either changes
+    them, see SharedEventDict.  `_copies` holds weak references to the
+    copies still sharing the events of self.
+    """
+
+    ## class level defaults, so that also objects that were not
+    ## initialized through __init__ (unpickling) have them.
+    _sorted = None
+    _bounds = None
+    _arrays = None
+    _numeric = None
+    _copies = ()
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *(_unshared(arg) for arg in args), **kwargs)
+        self._forget()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_copies', None)
+        return state
+
+    def _release(self):
+        """give the copies sharing the events of self their own events
+
+        called before self changes.
+        """
+
+        copies, self._copies = self._copies, ()
+        for ref in copies:
+            copy = ref()
+            if copy is not None:
+                copy._materialize()
+
+    def _forget(self):
+        """drop cached index, bounds and arrays
+        """
+
+        self._sorted = None
+        self._bounds = None
+        self._arrays = None
+
+    @classmethod
+    def from_arrays(cls, stamps, values, flags):
+        """return events built from sorted column arrays
+        """
+
+        keys = epochs_to_datetimes(stamps)
+        result = cls(zip(keys, zip(values.tolist(), flags.tolist(),
+                                   [''] * len(keys))))
+        result._sorted = keys
+        if keys:
+            result._bounds = (keys[0], keys[-1])
+        result._arrays = result._numeric = _columns(stamps, values, flags)
+        return result
+
+    def __setitem__(self, key, event):
+        if self._copies:
+            self._release()
+        self._arrays = None
+        if key not in self:
+            if self._sorted is not None:
+                if not self._sorted or self._sorted[-1] < key:
+                    self._sorted.append(key)
+                else:
+                    self._sorted = None
+            if not self:
+                self._bounds = (key, key)
+            elif self._bounds is not None:
+                first, last = self._bounds
+                self._bounds = (min(first, key), max(last, key))
+        dict.__setitem__(self, key, event)
+
+    def __delitem__(self, key):
+        if self._copies:
+            self._release()
+        dict.__delitem__(self, key)
+        self._arrays = None
+        if self._sorted is not None:
+            del self._sorted[bisect_left(self._sorted, key)]
+        if self._bounds is not None and key in self._bounds:
+            self._bounds = None
+
+    def pop(self, *args):
+        if self._copies:
+            self._release()
+        self._forget()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        if self._copies:
+            self._release()
+        self._forget()
+        return dict.popitem(self)
+
+    def clear(self):
+        if self._copies:
+            self._release()
+        self._forget()
+        dict.clear(self)
+
+    def update(self, *args, **kwargs):
+        if self._copies:
+            self._release()
+        self._forget()
+        dict.update(self, *(_unshared(arg) for arg in args), **kwargs)
+
+    def extend(self, items):
+        """add (key, event) pairs in one operation
+
+        `items` is a list sorted by key, without duplicates.  the
+        sorted index is kept, by merging the new keys into it.
+        """
+
+        if self._copies:
+            self._release()
+        keys = self.sorted_keys()
+        new = [k for (k, e) in items if k not in self]
+        dict.update(self, items)
+        self._forget()
+        if new and keys and new[0] < keys[-1]:
+            ## two sorted runs: timsort merges them in linear time.
+            self._sorted = sorted(keys + new)
+        else:
+            self._sorted = keys + new
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def copy(self):
+        """return a copy of self
+
+        the copy reads the events of self until either of the two
+        changes them: only then the events are copied.
+        """
+
+        result = SharedEventDict(self)
+        self._copies = [ref for ref in self._copies if ref() is not None]
+        self._copies.append(weakref.ref(result))
+        return result
+
+    def _copy(self):
+        """return a copy of self, sharing nothing with self
+        """
+
+        result = EventDict(self)
+        if self._sorted is not None:
+            result._sorted = list(self._sorted)
+        result._bounds = self._bounds
+        result._arrays = self._arrays
+        result._numeric = self._numeric
+        return result
+
+    def sorted_keys(self):
+        """return the sorted list of keys
+
+        the list is cached: callers must not modify it.
+        """
+
+        if self._sorted is None:
+            self._sorted = sorted(self)
+        return self._sorted
+
+    def assign(self, stamps, values, flags):
+        """replace all events by the given sorted column arrays
+
+        the dictionary itself is reused, and so is its sorted index if
+        the timestamps did not change.
+        """
+
+        if self._copies:
+            self._release()
+        if np.array_equal(stamps, self.stamps()):
+            keys = self.sorted_keys()
+            bounds = self._bounds
+        else:
+            keys = epochs_to_datetimes(stamps)
+            bounds = None
+        dict.clear(self)
+        dict.update(self, zip(keys, zip(values.tolist(), flags.tolist(),
+                                        [''] * len(keys))))
+        self._forget()
+        self._sorted = keys
+        if bounds is None and keys:
+            bounds = (keys[0], keys[-1])
+        self._bounds = bounds
+        self._arrays = self._numeric = _columns(stamps, values, flags)
+
+    def apply(self, func):
+        """replace values by func(values), keeping flags and comments
+        """
+
+        if self._copies:
+            self._release()
+        values = func(self.arrays()[1]).tolist()
+        for key, value in zip(self.sorted_keys(), values):
+            event = _as_event(self[key])
+            dict.__setitem__(self, key, (value, ) + tuple(event[1:]))
+        self._arrays = None
+
+    def stamps(self):
+        """return the sorted timestamps as a read-only int64 array
+
+        the values are not read: they need not be numbers.
+        """
+
+        if self._arrays is not None:
+            return self._arrays[0]
+        return _read_only(datetimes_to_epochs(self.sorted_keys()))
+
+    def arrays(self):
+        """return read-only (timestamps, values, flags) column arrays
+
+        timestamps are int64 microseconds since EPOCH, sorted; values
+        are float64, flags int8.
+        """
+
+        if self._arrays is None:
+            keys = self.sorted_keys()
+            events = [_as_event(self[k]) for k in keys]
+            self._arrays = _columns(datetimes_to_epochs(keys),
+                                    [e[0] for e in events],
+                                    [e[1] for e in events])
+        return self._arrays
+
+    def numeric_arrays(self):
+        """return (timestamps, values, flags, numeric) column arrays
+
+        as arrays, for events whose value need not be a number.
+        `numeric` is a boolean array telling which values are numbers,
+        or None if all are; the others (None, strings) are nan.
+        """
+
+        ## _numeric is the cached arrays once known to hold numbers.
+        if self._arrays is not None and self._numeric is self._arrays:
+            return self._arrays + (None, )
+        keys = self.sorted_keys()
+        events = [_as_event(self[k]) for k in keys]
+        numeric = np.array([isinstance(e[0], Real) for e in events],
+                           dtype=bool)
+        if numeric.all():
+            if self._arrays is None:
+                self._arrays = _columns(datetimes_to_epochs(keys),
+                                        [e[0] for e in events],
+                                        [e[1] for e in events])
+            self._numeric = self._arrays
+            return self._arrays + (None, )
+        return _columns(datetimes_to_epochs(keys),
+                        [e[0] if n else np.nan
+                         for (e, n) in zip(events, numeric)],
+                        [e[1] for e in events]) + (numeric, )
+
+    def comments(self):
+        """return {timestamp: comment} for the events with a comment
+
+        timestamps are int64 microseconds since EPOCH.
+        """
+
+        keys = self.sorted_keys()
+        stamps = self.arrays()[0].tolist()
+        return dict((stamp, event[2])
+                    for (stamp, event) in zip(
+                        stamps, (_as_event(self[k]) for k in keys))
+                    if event[2])
+
+    def bounds(self):
+        """return (first, last) key, or None if empty
+        """
+
+        if not self:
+            return None
+        if self._bounds is None:
+            if self._sorted is not None:
+                self._bounds = (self._sorted[0], self._sorted[-1])
+            else:
+                self._bounds = (min(self), max(self))
+        return self._bounds
+
+    def items_between(self, start=None, end=None):
+        """return sorted (timestamp, event) pairs from start to end
+
+        bounds are inclusive, None means unbounded.
+        """
+
+        keys = self.sorted_keys()
+        lo = 0 if start is None else bisect_left(keys, start)
+        hi = len(keys) if end is None else bisect_right(keys, end)
+        return [(k, self[k]) for k in keys[lo:hi]]
+
+    def items_at(self, dates):
+        """return sorted (timestamp, event) pairs for the given dates
+        """
+
+        return [(k, self[k]) for k in sorted(set(dates)) if k in self]
+
+    def take(self, positions):
+        """return the events at `positions` of the sorted index
+
+        `positions` is a slice or an array of increasing indices.
+        """
+
+        keys = self.sorted_keys()
+        if isinstance(positions, slice):
+            keys = keys[positions]
+        else:
+            keys = [keys[i] for i in positions.tolist()]
+        result = EventDict((k, self[k]) for k in keys)
+        result._sorted = keys
+        return result
+
+
+def _unshared(events):
+    """return the EventDict that `events` reads, if it is a SharedEventDict
+    """
+
+    if isinstance(events, SharedEventDict):
+        return events._events
+    return events
+
+
+def _shared_reader(name):
+    """return a method reading the events that are read by self
+    """
+
+    def method(self, *args, **kwargs):
+        return getattr(self._events, name)(*args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+def _shared_writer(name):
+    """return a method taking its own events before it changes them
+    """
+
+    def method(self, *args, **kwargs):
+        self._materialize()
+        return getattr(self._events, name)(*args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+class SharedEventDict(MutableMapping):
+    """copy of an EventDict, reading the events of its source
+
+    `_events` is the source until either the copy or the source
+    changes: the events of the source are then copied into an EventDict
+    of the copy's own.  this is not a dict, so that no code reads the
+    events through the C implementation of dict, past these methods.
+    """
+
+    def __init__(self, source):
+        self._events = source
+        self._shared = True
+
+    def _materialize(self):
+        """copy the events of the source, if they are still shared
+        """
+
+        if self._shared:
+            self._events = self._events._copy()
+            self._shared = False
+
+    @classmethod
+    def from_arrays(cls, stamps, values, flags):
+        return EventDict.from_arrays(stamps, values, flags)
+
+    def copy(self):
+        return self._events.copy()
+
+    def __eq__(self, other):
+        return self._events == _unshared(other)
+
+    def __ne__(self, other):
+        return self._events != _unshared(other)
+
+    def __reduce__(self):
+        ## an EventDict of its own, sharing nothing mutable.
+        events = self._events._copy()
+        return (EventDict, (), events.__getstate__(), None,
+                events.iteritems())
+
+    ## reading the events.
+    __getitem__ = _shared_reader('__getitem__')
+    __contains__ = _shared_reader('__contains__')
+    __iter__ = _shared_reader('__iter__')
+    __len__ = _shared_reader('__len__')
+    __repr__ = _shared_reader('__repr__')
+    get = _shared_reader('get')
+    has_key = _shared_reader('has_key')
+    keys = _shared_reader('keys')
+    values = _shared_reader('values')
+    items = _shared_reader('items')
+    iterkeys = _shared_reader('iterkeys')
+    itervalues = _shared_reader('itervalues')
+    iteritems = _shared_reader('iteritems')
+    sorted_keys = _shared_reader('sorted_keys')
+    stamps = _shared_reader('stamps')
+    arrays = _shared_reader('arrays')
+    numeric_arrays = _shared_reader('numeric_arrays')
+    comments = _shared_reader('comments')
+    bounds = _shared_reader('bounds')
+    items_between = _shared_reader('items_between')
+    items_at = _shared_reader('items_at')
+    take = _shared_reader('take')
+
+    ## changing the events, after taking them from the source.
+    __setitem__ = _shared_writer('__setitem__')
+    __delitem__ = _shared_writer('__delitem__')
+    pop = _shared_writer('pop')
+    popitem = _shared_writer('popitem')
+    clear = _shared_writer('clear')
+    update = _shared_writer('update')
+    extend = _shared_writer('extend')
+    setdefault = _shared_writer('setdefault')
+    assign = _shared_writer('assign')
+    apply = _shared_writer('apply')
+
+
+class ColumnarEvents(object):
+    """mapping timestamp -> (value, flag, comment), stored per column
+
+    timestamps are kept as a sorted int64 array of microseconds since
+    EPOCH, values as float64 and flags as int8.  comments are only kept
+    for events that have one.
+
+    timestamps that are not yet in the columns are collected in a
+    pending dictionary and merged into the columns the first time the
+    columns are needed, so that filling a series one event at a time
+    does not cost a full array copy per event.
+
+    copies share their columns with the original until either writes
+    to them: `_shared` names the columns that must be copied before
+    they are modified in place.  timestamps are never modified in
+    place, so they can be shared forever.
+    """
+
+    def __init__(self, events=()):
+        self._stamps = np.empty(0, dtype=np.int64)
+        self._values = np.empty(0, dtype=np.float64)
+        self._flags = np.empty(0, dtype=np.int8)
+        self._comments = {}
+        self._pending = {}
+        self._keys = None
+        self._shared = set()
+        self.update(events)
+
+    def _unshare(self):
+        """copy the columns shared with copies of self
+        """
+
+        for name in self._shared:
+            setattr(self, name, getattr(self, name).copy())
+        self._shared = set()
+
+    @classmethod
+    def from_arrays(cls, stamps, values, flags):
+        """return events adopting the given sorted column arrays
+
+        timestamps are never modified in place, so they may be shared.
+        values and flags belong to the caller: they are copied before
+        the first change.
+        """
+
+        result = cls()
+        result._stamps = np.asarray(stamps, dtype=np.int64)
+        result._values = np.asarray(values, dtype=np.float64)
+        result._flags = np.asarray(flags, dtype=np.int8)
+        result._shared = set(['_values', '_flags'])
+        return result
+
+    def _index(self, epoch):
+        """return position of `epoch` in the columns, or None
+        """
+
+        index = self._stamps.searchsorted(epoch)
+        if index < len(self._stamps) and self._stamps[index] == epoch:
+            return index
+        return None
+
+    def _consolidate(self):
+        """merge pending events into the columns
+        """
+
+        if not self._pending:
+            return
+        pending = sorted(self._pending.items())
+        self._pending = {}
+        self._merge(np.array([k for (k, v) in pending], dtype=np.int64),
+                    np.array([v[0] for (k, v) in pending], dtype=np.float64),
+                    np.array([v[1] for (k, v) in pending], dtype=np.int8))
+
+    def _merge(self, stamps, values, flags):
+        """merge sorted columns of new timestamps into the columns
+
+        return whether the new columns were simply appended.
+        """
+
+        append = (len(self._stamps) == 0 or
+                  stamps[0] > self._stamps[-1])
+        stamps = np.concatenate((self._stamps, stamps))
+        values = np.concatenate((self._values, values))
+        flags = np.concatenate((self._flags, flags))
+        if not append:
+            order = stamps.argsort(kind='mergesort')
+            stamps, values, flags = stamps[order], values[order], flags[order]
+        self._stamps, self._values, self._flags = stamps, values, flags
+        self._shared = set()
+        return append
+
+    def __setitem__(self, key, event):
+        value, flag, comment = _as_event(event)
+        if value is None:
+            value = np.nan
+        epoch = datetime_to_epoch(key)
+        index = self._index(epoch)
+        if index is None:
+            if epoch not in self._pending:
+                self._keys = None
+            self._pending[epoch] = (value, flag)
+        else:
+            self._unshare()
+            self._values[index] = value
+            self._flags[index] = flag
+        if comment:
+            self._comments[epoch] = comment
+        else:
+            self._comments.pop(epoch, None)
+
+    def __getitem__(self, key):
+        epoch = datetime_to_epoch(key)
+        comment = self._comments.get(epoch, '')
+        if epoch in self._pending:
+            value, flag = self._pending[epoch]
+            return float(value), int(flag), comment
+        index = self._index(epoch)
+        if index is None:
+            raise KeyError(key)
+        return float(self._values[index]), int(self._flags[index]), comment
+
+    def __delitem__(self, key):
+        epoch = datetime_to_epoch(key)
+        self._comments.pop(epoch, None)
+        self._keys = None
+        if epoch in self._pending:
+            del self._pending[epoch]
+            return
+        index = self._index(epoch)
+        if index is None:
+            raise KeyError(key)
+        self._stamps = np.delete(self._stamps, index)
+        self._values = np.delete(self._values, index)
+        self._flags = np.delete(self._flags, index)
+        self._shared = set()
+
+    def __contains__(self, key):
+        epoch = datetime_to_epoch(key)
+        return epoch in self._pending or self._index(epoch) is not None
+
+    def __len__(self):
+        return len(self._stamps) + len(self._pending)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, ColumnarEvents):
+            self._consolidate()
+            other._consolidate()
+            return (np.array_equal(self._stamps, other._stamps) and
+                    np.array_equal(self._values, other._values) and
+                    np.array_equal(self._flags, other._flags) and
+                    self._comments == other._comments)
+        if hasattr(other, 'items'):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __repr__(self):
+        return 'ColumnarEvents(%r)' % dict(self.items())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def sorted_keys(self):
+        """return the sorted list of timestamps
+
+        the list is cached: callers must not modify it.
+        """
+
+        if self._keys is None:
+            self._consolidate()
+            self._keys = epochs_to_datetimes(self._stamps)
+        return self._keys
+
+    def keys(self):
+        """return list of timestamps, sorted
+        """
+
+        return list(self.sorted_keys())
+
+    def stamps(self):
+        """return the sorted timestamps as a read-only int64 array
+        """
+
+        self._consolidate()
+        return _read_only(self._stamps)
+
+    def arrays(self):
+        """return read-only (timestamps, values, flags) column arrays
+
+        timestamps are int64 microseconds since EPOCH, sorted; values
+        are float64, flags int8.
+        """
+
+        self._consolidate()
+        return (_read_only(self._stamps), _read_only(self._values),
+                _read_only(self._flags))
+
+    def numeric_arrays(self):
+        """return (timestamps, values, flags, None) column arrays
+
+        see EventDict.numeric_arrays: all values are numbers.
+        """
+
+        return self.arrays() + (None, )
+
+    def assign(self, stamps, values, flags):
+        """replace all events by the given sorted column arrays
+
+        if the timestamps did not change, the new values and flags are
+        copied into the existing columns.
+        """
+
+        self._consolidate()
+        self._comments = {}
+        same = np.array_equal(stamps, self._stamps)
+        if same and not self._shared:
+            self._values[...] = values
+            self._flags[...] = flags
+            return
+        if not same:
+            self._stamps = np.array(stamps, dtype=np.int64)
+            self._keys = None
+        self._values = np.array(values, dtype=np.float64)
+        self._flags = np.array(flags, dtype=np.int8)
+        self._shared = set()
+
+    def apply(self, func):
+        """replace values by func(values), keeping flags and comments
+        """
+
+        self._consolidate()
+        if '_values' in self._shared:
+            self._values = np.array(func(self._values), dtype=np.float64)
+            self._shared.discard('_values')
+        else:
+            self._values[...] = func(self._values)
+
+    def comments(self):
+        """return {timestamp: comment} for the events with a comment
+
+        timestamps are int64 microseconds since EPOCH.
+        """
+
+        return dict(self._comments)
+
+    def bounds(self):
+        """return (first, last) timestamp, or None if empty
+        """
+
+        self._consolidate()
+        if not len(self._stamps):
+            return None
+        if self._keys is not None:
+            return self._keys[0], self._keys[-1]
+        return (epoch_to_datetime(self._stamps[0]),
+                epoch_to_datetime(self._stamps[-1]))
+
+    def values(self):
+        """return list of (value, flag, comment) events, sorted by timestamp
+        """
+
+        return [v for (k, v) in self.items()]
+
+    def items(self):
+        """return list of (timestamp, event) pairs, sorted by timestamp
+        """
+
+        self._consolidate()
+        return self._items(slice(None))
+
+    def _items(self, selection):
+        """return (timestamp, event) pairs at positions `selection`
+
+        `selection` indexes the consolidated columns.
+        """
+
+        stamps = self._stamps[selection]
+        if self._keys is not None and isinstance(selection, slice):
+            keys = self._keys[selection]
+        else:
+            keys = epochs_to_datetimes(stamps)
+        if self._comments:
+            comments = [self._comments.get(k, '') for k in stamps.tolist()]
+        else:
+            comments = [''] * len(stamps)
+        return list(zip(keys, zip(self._values[selection].tolist(),
+                                  self._flags[selection].tolist(),
+                                  comments)))
+
+    def items_between(self, start=None, end=None):
+        """return sorted (timestamp, event) pairs from start to end
+
+        bounds are inclusive, None means unbounded.
+        """
+
+        self._consolidate()
+        lo, hi = 0, len(self._stamps)
+        if start is not None:
+            lo = self._stamps.searchsorted(datetime_to_epoch(start), 'left')
+        if end is not None:
+            hi = self._stamps.searchsorted(datetime_to_epoch(end), 'right')
+        return self._items(slice(lo, hi))
+
+    def items_at(self, dates):
+        """return sorted (timestamp, event) pairs for the given dates
+        """
+
+        self._consolidate()
+        wanted = datetimes_to_epochs(list(dates))
+        return self._items(np.flatnonzero(np.in1d(self._stamps, wanted)))
+
+    def take(self, positions):
+        """return the events at `positions` of the sorted columns
+
+        `positions` is a slice or an array of increasing indices.  the
+        columns of a slice are shared with self until either writes.
+        """
+
+        self._consolidate()
+        result = ColumnarEvents()
+        result._stamps = self._stamps[positions]
+        result._values = self._values[positions]
+        result._flags = self._flags[positions]
+        if isinstance(positions, slice) and len(result._stamps):
+            if self._keys is not None:
+                result._keys = self._keys[positions]
+            self._shared.update(['_values', '_flags'])
+            result._shared = set(['_values', '_flags'])
+        if self._comments:
+            kept = set(result._stamps.tolist())
+            result._comments = dict((k, c)
+                                    for (k, c) in self._comments.items()
+                                    if k in kept)
+        return result
+
+    def extend(self, items):
+        """add (timestamp, event) pairs in one operation
+
+        `items` is a list sorted by timestamp, without duplicates.
+        """
+
+        self._consolidate()
+        if not items:
+            return
+        keys = [k for (k, e) in items]
+        events = [_as_event(e) for (k, e) in items]
+        stamps = datetimes_to_epochs(keys)
+        if len(self._stamps):
+            kept = ~np.in1d(self._stamps, stamps)
+            if not kept.all():
+                self._stamps = self._stamps[kept]
+                self._values = self._values[kept]
+                self._flags = self._flags[kept]
+                self._keys = None
+        for epoch, event in zip(stamps.tolist(), events):
+            if event[2]:
+                self._comments[epoch] = event[2]
+            else:
+                self._comments.pop(epoch, None)
+        known = self._keys
+        append = self._merge(
+            stamps,
+            np.array([e[0] for e in events], dtype=np.float64),
+            np.array([e[1] for e in events], dtype=np.int8))
+        if append and known is not None:
+            self._keys = known + keys
+        else:
+            self._keys = None
+
+    def update(self, events):
+        """behave as a dictionary
+        """
+
+        if hasattr(events, 'items'):
+            events = events.items()
+        for key, event in events:
+            self[key] = event
+
+    def copy(self):
+        """return a copy of self
+
+        the copy shares the columns with self, until either of the two
+        modifies them.
+        """
+
+        self._consolidate()
+        result = ColumnarEvents()
+        result._stamps = self._stamps
+        result._values = self._values
+        result._flags = self._flags
+        result._comments = dict(self._comments)
+        result._keys = self._keys
+        self._shared = set(['_values', '_flags'])
+        result._shared = set(['_values', '_flags'])
+        return result
+
+
+class OffGridError(ValueError):
+    """a timestamp does not fit the grid of equidistant events
+    """
+
+
+def _infer_step(stamps):
+    """return the step of the sorted int64 `stamps`, or None
+
+    the step is the smallest difference between consecutive stamps,
+    provided all differences are a multiple of it.
+    """
+
+    if len(stamps) < 2:
+        return None
+    differences = np.diff(stamps)
+    step = int(differences.min())
+    if step <= 0 or (differences % step).any():
+        return None
+    return step
+
+
+class EquidistantEvents(object):
+    """events on a regular grid of timestamps
+
+    values and flags are kept in contiguous arrays indexed by the
+    amount of steps from the first timestamp, so that the position of
+    a timestamp is computed rather than searched.  grid slots without
+    an event are masked.  the first and the last slot always hold an
+    event.
+
+    setting an event off the grid raises OffGridError, and so does
+    setting one so far from the others that most of the grid would be
+    masked.
+    """
+
+    ## the grid may grow up to this many slots per event, plus slack.
+    _density = 4
+    _slack = 4096
+
+    def __init__(self, events=(), step=None):
+        if hasattr(events, 'items'):
+            events = events.items()
+        events = sorted(events)
+        if isinstance(step, timedelta):
+            step = datetime_to_epoch(EPOCH + step)
+        elif step is None:
+            step = _infer_step(datetimes_to_epochs([k for (k, e) in events]))
+            if step is None:
+                raise ValueError("can't tell the step of equidistant events")
+        if step <= 0:
+            raise ValueError("step of equidistant events must be positive")
+        self._step = step
+        self._clear()
+        for key, event in events:
+            self[key] = event
+
+    def _clear(self):
+        self._start = None
+        self._size = 0
+        self._count = 0
+        self._values = np.empty(0, dtype=np.float64)
+        self._flags = np.empty(0, dtype=np.int8)
+        self._mask = np.empty(0, dtype=bool)
+        self._comments = {}
+        self._keys = None
+
+    @classmethod
+    def from_arrays(cls, stamps, values, flags, step=None):
+        """return events built from sorted column arrays
+
+        without a `step`, it is inferred from the timestamps.  if the
+        timestamps are not equidistant, columnar events are returned.
+        """
+
+        stamps = np.asarray(stamps, dtype=np.int64)
+        if isinstance(step, timedelta):
+            step = datetime_to_epoch(EPOCH + step)
+        elif step is None:
+            step = _infer_step(stamps)
+        result = None
+        if step is not None:
+            result = cls(step=step)
+            try:
+                result.assign(stamps, values, flags)
+            except OffGridError:
+                result = None
+        if result is None:
+            result = ColumnarEvents.from_arrays(stamps, values, flags)
+        return result
+
+    def _slot(self, epoch):
+        """return the slot holding `epoch`, or None
+        """
+
+        if self._start is None:
+            return None
+        index, rest = divmod(epoch - self._start, self._step)
+        if rest or not 0 <= index < self._size or self._mask[index]:
+            return None
+        return index
+
+    def _check_density(self, size, count):
+        if size > self._density * count + self._slack:
+            raise OffGridError("grid of %d slots for %d events" %
+                               (size, count))
+
+    def _resize(self, shift, size):
+        """make room for `size` slots, moving the current ones `shift`
+        slots up.  capacity grows by doubling, so that appending one
+        event at a time costs amortized constant time.
+        """
+
+        if shift == 0 and size <= len(self._values):
+            self._size = size
+            return
+        capacity = max(size, 2 * len(self._values))
+        values = np.empty(capacity, dtype=np.float64)
+        flags = np.zeros(capacity, dtype=np.int8)
+        mask = np.ones(capacity, dtype=bool)
+        old = slice(shift, shift + self._size)
+        values[old] = self._values[:self._size]
+        flags[old] = self._flags[:self._size]
+        mask[old] = self._mask[:self._size]
+        self._values, self._flags, self._mask = values, flags, mask
+        self._start -= shift * self._step
+        self._size = size
+
+    def __setitem__(self, key, event):
+        value, flag, comment = _as_event(event)
+        if value is None:
+            value = np.nan
+        epoch = datetime_to_epoch(key)
+        if self._start is None:
+            self._start = epoch
+            self._resize(0, 1)
+        index, rest = divmod(epoch - self._start, self._step)
+        if rest:
+            raise OffGridError("%s is not on the grid" % key)
+        if index < 0:
+            self._check_density(self._size - index, self._count + 1)
+            self._resize(-index, self._size - index)
+            index = 0
+        elif index >= self._size:
+            self._check_density(index + 1, self._count + 1)
+            self._resize(0, index + 1)
+        if self._mask[index]:
+            self._mask[index] = False
+            self._count += 1
+            self._keys = None
+        self._values[index] = value
+        self._flags[index] = flag
+        if comment:
+            self._comments[epoch] = comment
+        else:
+            self._comments.pop(epoch, None)
+
+    def __getitem__(self, key):
+        epoch = datetime_to_epoch(key)
+        index = self._slot(epoch)
+        if index is None:
+            raise KeyError(key)
+        return (float(self._values[index]), int(self._flags[index]),
+                self._comments.get(epoch, ''))
+
+    def __delitem__(self, key):
+        epoch = datetime_to_epoch(key)
+        index = self._slot(epoch)
+        if index is None:
+            raise KeyError(key)
+        self._mask[index] = True
+        self._count -= 1
+        self._comments.pop(epoch, None)
+        self._keys = None
+        if not self._count:
+            self._clear()
+        elif index == 0:
+            ## keep an event in the first slot.
+            first = int(np.argmin(self._mask[:self._size]))
+            self._values = self._values[first:]
+            self._flags = self._flags[first:]
+            self._mask = self._mask[first:]
+            self._start += first * self._step
+            self._size -= first
+        elif index == self._size - 1:
+            ## keep an event in the last slot.
+            self._size -= int(np.argmin(self._mask[self._size - 1::-1]))
+
+    def __contains__(self, key):
+        return self._slot(datetime_to_epoch(key)) is not None
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return iter(self.sorted_keys())
+
+    def __eq__(self, other):
+        if isinstance(other, EquidistantEvents):
+            mine, yours = self.arrays(), other.arrays()
+            return (all(np.array_equal(a, b) for (a, b) in zip(mine, yours))
+                    and self._comments == other._comments)
+        if hasattr(other, 'items'):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __repr__(self):
+        return 'EquidistantEvents(%r)' % dict(self.items())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def _present(self):
+        """return the slots holding an event
+        """
+
+        return np.flatnonzero(~self._mask[:self._size])
+
+    def sorted_keys(self):
+        """return the sorted list of keys
+
+        the list is cached: callers must not modify it.
+        """
+
+        if self._keys is None:
+            self._keys = epochs_to_datetimes(self.arrays()[0])
+        return self._keys
+
+    def keys(self):
+        return list(self.sorted_keys())
+
+    @property
+    def step(self):
+        """the distance between the slots of the grid, as a timedelta
+        """
+
+        return timedelta(microseconds=self._step)
+
+    def masked_values(self):
+        """return the values on the grid as a numpy masked array
+
+        the array views the storage: it is contiguous, and slots
+        without an event are masked.
+        """
+
+        return np.ma.MaskedArray(self._values[:self._size],
+                                 mask=self._mask[:self._size])
+
+    def stamps(self):
+        """return the sorted timestamps as a read-only int64 array
+        """
+
+        return self.arrays()[0]
+
+    def arrays(self):
+        """return read-only (timestamps, values, flags) column arrays
+
+        timestamps are int64 microseconds since EPOCH, sorted; values
+        are float64, flags int8.  without masked slots, values and
+        flags are views of the storage.
+        """
+
+        if self._count == self._size:
+            slots = slice(0, self._size)
+            stamps = np.arange(self._size, dtype=np.int64)
+        else:
+            slots = stamps = self._present()
+        if self._start is not None:
+            stamps = self._start + self._step * stamps
+        return (_read_only(stamps), _read_only(self._values[slots]),
+                _read_only(self._flags[slots]))
+
+    def numeric_arrays(self):
+        """return (timestamps, values, flags, None) column arrays
+
+        see EventDict.numeric_arrays: all values are numbers.
+        """
+
+        return self.arrays() + (None, )
+
+    def assign(self, stamps, values, flags):
+        """replace all events by the given sorted column arrays
+
+        raise OffGridError, leaving self unchanged, if the timestamps
+        do not fit a grid with the step of self.
+        """
+
+        stamps = np.asarray(stamps, dtype=np.int64)
+        if not len(stamps):
+            self._clear()
+            return
+        index, rest = np.divmod(stamps - stamps[0], self._step)
+        if rest.any():
+            raise OffGridError("timestamps are not on the grid")
+        size = int(index[-1]) + 1
+        self._check_density(size, len(stamps))
+        self._clear()
+        self._start = int(stamps[0])
+        self._resize(0, size)
+        self._values[index] = values
+        self._flags[index] = flags
+        self._mask[index] = False
+        self._count = len(stamps)
+
+    def apply(self, func):
+        """replace values by func(values), keeping flags and comments
+        """
+
+        if self._count == self._size:
+            self._values[:self._size] = func(self._values[:self._size])
+        else:
+            slots = self._present()
+            self._values[slots] = func(self._values[slots])
+
+    def comments(self):
+        """return {timestamp: comment} for the events with a comment
+
+        timestamps are int64 microseconds since EPOCH.
+        """
+
+        return dict(self._comments)
+
+    def bounds(self):
+        """return (first, last) timestamp, or None if empty
+        """
+
+        if self._start is None:
+            return None
+        return (epoch_to_datetime(self._start),
+                epoch_to_datetime(self._start +
+                                  (self._size - 1) * self._step))
+
+    def values(self):
+        """return list of (value, flag, comment) events, sorted by timestamp
+        """
+
+        return [v for (k, v) in self.items()]
+
+    def items(self):
+        """return list of (timestamp, event) pairs, sorted by timestamp
+        """
+
+        return self._items(self._present())
+
+    def _items(self, slots):
+        """return (timestamp, event) pairs at the given sorted slots
+        """
+
+        stamps = self._start + self._step * slots
+        if self._comments:
+            comments = [self._comments.get(k, '') for k in stamps.tolist()]
+        else:
+            comments = [''] * len(slots)
+        return list(zip(epochs_to_datetimes(stamps),
+                        zip(self._values[slots].tolist(),
+                            self._flags[slots].tolist(),
+                            comments)))
+
+    def items_between(self, start=None, end=None):
+        """return sorted (timestamp, event) pairs from start to end
+
+        bounds are inclusive, None means unbounded.  the slots of the
+        bounds are computed, not searched.
+        """
+
+        if self._start is None:
+            return []
+        lo, hi = 0, self._size
+        if start is not None:
+            offset = datetime_to_epoch(start) - self._start
+            lo = min(max(0, -(-offset // self._step)), self._size)
+        if end is not None:
+            offset = datetime_to_epoch(end) - self._start
+            hi = min(max(0, offset // self._step + 1), self._size)
+        hi = max(lo, hi)
+        return self._items(lo + np.flatnonzero(~self._mask[lo:hi]))
+
+    def items_at(self, dates):
+        """return sorted (timestamp, event) pairs for the given dates
+        """
+
+        if self._start is None:
+            return []
+        epochs = datetimes_to_epochs(list(dates))
+        index, rest = np.divmod(epochs - self._start, self._step)
+        index = index[(rest == 0) & (index >= 0) & (index < self._size)]
+        index = index[~self._mask[index]]
+        return self._items(np.unique(index))
+
+    def take(self, positions):
+        """return the events at `positions` of the sorted events
+
+        `positions` is a slice or an array of increasing indices.  if
+        the selected events are too sparse for the grid, they are
+        returned as columnar events.
+        """
+
+        stamps, values, flags = self.arrays()
+        result = self.from_arrays(stamps[positions], values[positions],
+                                  flags[positions], self._step)
+        if self._comments:
+            kept = set(stamps[positions].tolist())
+            result._comments = dict((k, c)
+                                    for (k, c) in self._comments.items()
+                                    if k in kept)
+        return result
+
+    def extend(self, items):
+        """add (timestamp, event) pairs, sorted by timestamp
+        """
+
+        for key, event in items:
+            self[key] = event
+
+    def update(self, events):
+        """behave as a dictionary
+        """
+
+        if hasattr(events, 'items'):
+            events = events.items()
+        for key, event in events:
+            self[key] = event
+
+    def copy(self):
+        """return a copy of self
+        """
+
+        result = EquidistantEvents(step=self._step)
+        result._start = self._start
+        result._size = self._size
+        result._count = self._count
+        result._values = self._values[:self._size].copy()
+        result._flags = self._flags[:self._size].copy()
+        result._mask = self._mask[:self._size].copy()
+        result._comments = dict(self._comments)
+        result._keys = self._keys
+        return result
+
+
+## storage engines for TimeSeries events, by name.
+ENGINES = {'dict': EventDict,
+           'columnar': ColumnarEvents,
+           'equidistant': EquidistantEvents,
+           }
@@ -27,6 +27,7 @@
 #
 #******************************************************************************
 
+from collections import Mapping
 import logging
 from datetime import datetime
 from datetime import timedelta
@@ -34,6 +35,18 @@ from xml.etree import ElementTree
 import re
 import operator
 
+import numpy as np
+
+from storage import ENGINES
+from storage import OffGridError
+from storage import as_epochs
+from storage import datetime_to_epoch
+from pidates import parse_date_time
+from pidates import to_datetime64
+from pitags import local_names
+import periods
+import piparse
+import windows
 
 logger = logging.getLogger(__name__)
 
@@ -47,7 +60,7 @@ def convert_dom(dom):
     """
     root = dom.getroot()
     for e in root.iter():
-        e.tag = re.sub('{.*}', '', e.tag)
+        e.tag = local_names[e.tag]
         if e.tag is None:
             e.tag = ''
 
@@ -75,6 +88,33 @@ def daily_events(events, default_value=0):
         date_to_yield = date + timedelta(1)
 
 
+def _aligned(keys, stamps, values, fill):
+    """return `values` taken at `keys`, `fill` where `stamps` lacks a key
+
+    `keys` and `stamps` are sorted int64 timestamp arrays, `values` is
+    the array associated to `stamps`.
+    """
+
+    if not len(stamps):
+        return np.repeat(np.array([fill], dtype=values.dtype), len(keys))
+    positions = stamps.searchsorted(keys).clip(0, len(stamps) - 1)
+    return np.where(stamps[positions] == keys, values[positions], fill)
+
+
+def _carried(keys, stamps, values, fill):
+    """return last `values` at or before `keys`, `fill` before the first
+
+    `keys` and `stamps` are sorted int64 timestamp arrays, `values` is
+    the array associated to `stamps`: last observation carried forward
+    as a forward fill index over the sorted timestamps.
+    """
+
+    if not len(stamps):
+        return np.repeat(np.array([fill], dtype=values.dtype), len(keys))
+    positions = stamps.searchsorted(keys, 'right') - 1
+    return np.where(positions >= 0, values[positions.clip(0)], fill)
+
+
 def deprecated(func):
     """This is a decorator which can be used to mark functions
     as deprecated. It will result in a warning being emitted
@@ -133,8 +173,63 @@ def str_to_datetime(date, time, offset=0):
     datetime.datetime(1999, 12, 31, 23, 0)
     """
 
-    return (datetime.strptime(date + 'T' + time, "%Y-%m-%dT%H:%M:%S") -
-            timedelta(0, offset * 3600))
+    return parse_date_time(date, time) - timedelta(0, offset * 3600)
+
+
+## length in seconds of the PI time step units of fixed length.
+_PI_STEP_SECONDS = {'second': 1,
+                    'minute': 60,
+                    'hour': 3600,
+                    'day': 86400,
+                    'week': 604800,
+                    }
+
+
+def _pi_time_step(node):
+    """return the timedelta declared by a PI `timeStep` element
+
+    None if there is no element, if it is "nonequidistant", or if its
+    unit has no fixed length (month, year).
+
+    >>> _pi_time_step(ElementTree.Element('timeStep', unit='minute',
+    ...                                   multiplier='15'))
+    datetime.timedelta(0, 900)
+    >>> _pi_time_step(ElementTree.Element('timeStep', unit='nonequidistant'))
+    """
+
+    if node is None:
+        return None
+    seconds = _PI_STEP_SECONDS.get(node.attrib.get('unit'))
+    if seconds is None:
+        return None
+    multiplier = int(node.attrib.get('multiplier', 1))
+    divider = int(node.attrib.get('divider', 1))
+    return timedelta(seconds=float(seconds) * multiplier / divider)
+
+
+def _pi_step_attrib(step):
+    """return the attributes of a PI `timeStep` element for `step`
+
+    a step that is not a whole number of seconds gets a divider.
+
+    >>> sorted(_pi_step_attrib(timedelta(hours=1)).items())
+    [('multiplier', '3600'), ('unit', 'second')]
+    >>> sorted(_pi_step_attrib(timedelta(milliseconds=250)).items())
+    [('divider', '4'), ('multiplier', '1'), ('unit', 'second')]
+    """
+
+    microseconds = ((step.days * 86400 + step.seconds) * 10 ** 6 +
+                    step.microseconds)
+    divider = 10 ** 6
+    for factor in (2, 5):
+        while divider > 1 and not (microseconds % factor or
+                                   divider % factor):
+            microseconds //= factor
+            divider //= factor
+    result = {'unit': 'second', 'multiplier': str(microseconds)}
+    if divider != 1:
+        result['divider'] = str(divider)
+    return result
 
 
 def _element_with_text(doc, tag, content='', attr={}):
@@ -158,7 +253,93 @@ def _append_element_to(element, tag, text='', attrib={}):
     element.append(child)
 
 
-class TimeSeries:
+def _interned(value):
+    """return `value`, interned if it is a str
+    """
+
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
+class SeriesHeader(object):
+    """the header fields of a TimeSeries
+
+    slotted, so that it carries no per-instance dictionary, and holding
+    interned strings, so that the many series read from one source
+    share their identifiers.  TimeSeries objects share their header
+    with their clones and copy it when one of its fields is set.
+    """
+
+    __slots__ = ('type', 'location_id', 'parameter_id', 'time_step',
+                 'miss_val', 'station_name', 'lat', 'lon', 'x', 'y', 'z',
+                 'units')
+
+    def __init__(self, **kwargs):
+        ## one of: instantaneous, continuous.  we usually work with
+        ## instantaneous
+        self.type = _interned(kwargs.get('type', ''))
+        ## these are used to identify the TimeSeries in a collection
+        self.location_id = _interned(kwargs.get('location_id'))
+        self.parameter_id = _interned(kwargs.get('parameter_id'))
+        ## datetime.timedelta or None (for nonequidistant)
+        self.time_step = _interned(kwargs.get('time_step', ''))
+        ## what to store in equidistant timeseries in case a value is
+        ## missing.
+        self.miss_val = _interned(kwargs.get('miss_val', ''))
+        ## don't ask me why wldelft wants this one
+        self.station_name = _interned(kwargs.get('station_name', ''))
+        ## geographic coordinates
+        self.lat = _interned(kwargs.get('lat', ''))
+        self.lon = _interned(kwargs.get('lon', ''))
+        ## Rijksdriehoekscoördinaten
+        self.x = _interned(kwargs.get('x', ''))
+        self.y = _interned(kwargs.get('y', ''))
+        self.z = _interned(kwargs.get('z', ''))
+        ## a string
+        self.units = _interned(kwargs.get('units', ''))
+
+    def _fields(self):
+        return tuple(getattr(self, k) for k in self.__slots__)
+
+    def __eq__(self, other):
+        return self is other or (isinstance(other, SeriesHeader) and
+                                 self._fields() == other._fields())
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __getstate__(self):
+        return self._fields()
+
+    def __setstate__(self, state):
+        for k, v in zip(self.__slots__, state):
+            setattr(self, k, _interned(v))
+
+    def replace(self, **kwargs):
+        """return a copy of self, with the given fields set
+        """
+
+        fields = dict(zip(self.__slots__, self._fields()))
+        fields.update(kwargs)
+        return SeriesHeader(**fields)
+
+
+def _header_field(name):
+    """return a property exposing field `name` of the header of a
+    TimeSeries, copying the header when the field is set
+    """
+
+    def get(self):
+        return getattr(self._header, name)
+
+    def set(self, value):
+        self._header = self._header.replace(**{name: value})
+
+    return property(get, set)
+
+
+class TimeSeries(object):
     """Describes a TimeSeries object.
 
     fields of TimeSeries shadow the content of <series> elements in
@@ -177,18 +358,15 @@ class TimeSeries:
 
         If dates is provided, only return values of given dates
         (ignore start_date and end_date).
+
+        the range is located by binary search over the sorted
+        timestamps, so only the requested slice is visited.
         """
 
-        if start_date is None:
-            start_date = self.get_start_date()
-        if end_date is None:
-            end_date = self.get_end_date()
         if dates is None:
-            return sorted([(k, v) for (k, v) in self._events.items()
-                           if start_date <= k <= end_date])
+            return self._events.items_between(start_date, end_date)
         else:
-            return sorted([(k, v) for (k, v) in self._events.items()
-                           if k in dates])
+            return self._events.items_at(dates)
 
     @deprecated
     def events(self, start_date=None, end_date=None):
@@ -207,32 +385,43 @@ class TimeSeries:
         result = self.get_events(start_date, end_date)
         return [(k, v[0]) for (k, v) in result]
 
+    ## the header fields, see SeriesHeader.  the class level default
+    ## serves objects that were not initialized through __init__.
+    _header = SeriesHeader()
+    type = _header_field('type')
+    location_id = _header_field('location_id')
+    parameter_id = _header_field('parameter_id')
+    time_step = _header_field('time_step')
+    miss_val = _header_field('miss_val')
+    station_name = _header_field('station_name')
+    lat = _header_field('lat')
+    lon = _header_field('lon')
+    x = _header_field('x')
+    y = _header_field('y')
+    z = _header_field('z')
+    units = _header_field('units')
+
     def __init__(self, events={}, **kwargs):
-        ## one of: instantaneous, continuous.  we usually work with
-        ## instantaneous
-        self.type = kwargs.get('type', '')
-        ## these are used to identify the TimeSeries in a collection
-        self.location_id = kwargs.get('location_id')
-        self.parameter_id = kwargs.get('parameter_id')
-        ## datetime.timedelta or None (for nonequidistant)
-        self.time_step = kwargs.get('time_step', '')
-        ## what to store in equidistant timeseries in case a value is
-        ## missing.
-        self.miss_val = kwargs.get('miss_val', '')
-        ## don't ask me why wldelft wants this one
-        self.station_name = kwargs.get('station_name', '')
-        ## geographic coordinates
-        self.lat = kwargs.get('lat', '')
-        self.lon = kwargs.get('lon', '')
-        ## Rijksdriehoekscoördinaten
-        self.x = kwargs.get('x', '')
-        self.y = kwargs.get('y', '')
-        self.z = kwargs.get('z', '')
-        ## a string
-        self.units = kwargs.get('units', '')
-        ## key: timestamp, value: (double, flag, comment)
-        self._events = dict(events)  # associate a timestamp to a
-                                    # value, let's make a copy of it
+        self._header = SeriesHeader(**kwargs)
+        ## key: timestamp, value: (double, flag, comment).  `storage`
+        ## names the engine holding the events, see storage.ENGINES.
+        storage = kwargs.get('storage', 'dict')
+        if storage == 'equidistant':
+            ## the grid of equidistant events is given by the time
+            ## step, or else by the events themselves.
+            step = self.time_step
+            if not isinstance(step, timedelta):
+                step = None
+            if not hasattr(events, 'items'):
+                events = list(events)
+            try:
+                self._events = ENGINES[storage](events, step=step)
+            except ValueError:
+                ## no step to tell, or events off its grid: as in
+                ## _leave_grid, the events go to columnar storage.
+                self._events = ENGINES['columnar'](events)
+        else:
+            self._events = ENGINES[storage](events)  # let's make a copy
         self.is_locf = False
         pass
 
@@ -242,11 +431,10 @@ class TimeSeries:
         returned value must match the events data
         """
 
-        timestamps = self._events.keys()
-        try:
-            return min(timestamps)
-        except:
+        bounds = self._events.bounds()
+        if bounds is None:
             return datetime(1970, 1, 1)
+        return bounds[0]
 
     def get_end_date(self):
         """return the last timestamp
@@ -254,11 +442,10 @@ class TimeSeries:
         returned value must match the events data
         """
 
-        timestamps = self._events.keys()
-        try:
-            return max(timestamps)
-        except:
+        bounds = self._events.bounds()
+        if bounds is None:
             return datetime(1970, 1, 1)
+        return bounds[1]
 
     def add_value(self, tstamp, value):
         """set value/event, fall back to __setitem__
@@ -282,23 +469,61 @@ class TimeSeries:
           'lte': lambda x, y: x <= y,
           'gt': lambda x, y: x > y,
           'gte': lambda x, y: x >= y,
+          'eq': lambda x, y: x == y,
+          'ne': lambda x, y: x != y,
           }
 
+    ## which end of the timestamp slice a timestamp predicate moves,
+    ## and the searchsorted side that gives its new position.
+    _slice_side = {'gt': (0, 'right'),
+                   'gte': (0, 'left'),
+                   'lt': (1, 'left'),
+                   'lte': (1, 'right'),
+                   }
+
     def filter(self, **kwargs):
-        """similar to django filter"""
+        """similar to django filter
+
+        accepts timestamp_{lt,lte,gt,gte}, value_{lt,lte,gt,gte,eq,ne}
+        and flag_{lt,lte,gt,gte,eq,ne}.  timestamp predicates narrow
+        one slice of the sorted events by binary search, value and flag
+        predicates are evaluated on the columns of that slice.
+        """
 
-        result = self.clone(with_events=True)
+        stamps = self._events.stamps()
+        ends = [0, len(stamps)]
+        tests = []
         for request in kwargs:
             field, op = request.split("_")
+            if field not in ('timestamp', 'value', 'flag'):
+                raise ValueError("unknown field %r" % field)
             value = kwargs[request]
             if value is None:
                 continue
 
-            assert(field == 'timestamp')
+            if field == 'timestamp':
+                end, side = self._slice_side[op]
+                position = np.searchsorted(
+                    stamps, datetime_to_epoch(value), side=side)
+                ends[end] = (max, min)[end](ends[end], position)
+            else:
+                tests.append((field, self._f[op], value))
+
+        first, last = ends[0], max(ends)
+        if tests:
+            ## only value and flag predicates read the values, which
+            ## then have to be numbers.
+            columns = dict(zip(('value', 'flag'),
+                               self._events.arrays()[1:]))
+            mask = np.ones(last - first, dtype=bool)
+            for field, f, value in tests:
+                mask &= f(columns[field][first:last], value)
+            positions = first + np.flatnonzero(mask)
+        else:
+            positions = slice(first, last)
 
-            for timestamp in set(result._events):
-                if not self._f[op](timestamp, value):
-                    del result._events[timestamp]
+        result = self.clone()
+        result._events = self._events.take(positions)
         return result
 
     def __setitem__(self, key, value):
@@ -309,7 +534,19 @@ class TimeSeries:
             template = list(self._events.get(key, (0, 0, '')))
             template[0] = value
             value = tuple(template)
-        self._events[key] = value
+        try:
+            self._events[key] = value
+        except OffGridError:
+            self._leave_grid()
+            self._events[key] = value
+
+    def _leave_grid(self):
+        """move the events of self from equidistant to columnar storage
+
+        called when an event does not fit the grid of self.
+        """
+
+        self._events = ENGINES['columnar'](self._events.items())
 
     def __getitem__(self, key):
         """behave as a dictionary (content is series events)
@@ -332,8 +569,92 @@ class TimeSeries:
 
         return self._events.get(key, default)
 
+    def extend(self, events):
+        """add many events in one operation
+
+        `events` is a dictionary or an iterable of (timestamp, event)
+        pairs.  as in __setitem__, an event that is not a tuple gives
+        the value part of the event.  the events are sorted once and
+        handed to the storage as one batch.
+        """
+
+        if hasattr(events, 'items'):
+            events = events.items()
+        batch = {}
+        for key, value in events:
+            if not isinstance(value, tuple):
+                if key in batch:
+                    template = list(batch[key])
+                else:
+                    template = list(self._events.get(key, (0, 0, '')))
+                template[0] = value
+                value = tuple(template)
+            batch[key] = value
+        batch = sorted(batch.items())
+        try:
+            self._events.extend(batch)
+        except OffGridError:
+            self._leave_grid()
+            self._events.extend(batch)
+
+    def update(self, events):
+        """behave as a dictionary, fall back to extend
+        """
+
+        self.extend(events)
+
     @classmethod
-    def _from_xml(cls, stream):
+    def from_arrays(cls, timestamps, values, flags=None, **kwargs):
+        """return a TimeSeries holding the given event columns
+
+        `timestamps` holds datetime objects, numpy datetime64 or int64
+        microseconds since 1970-01-01; `flags` defaults to all 0.  the
+        other keyword arguments are as in __init__.  a ValueError is
+        raised if the columns differ in length.
+
+        unless `storage` says otherwise, the events are held in
+        columnar storage, which adopts sorted arrays of the right type
+        (int64, float64, int8) without copying them: later changes to
+        such arrays show in the TimeSeries.  changes to the TimeSeries
+        itself copy them first.
+        """
+
+        storage = kwargs.setdefault('storage', 'columnar')
+        stamps = as_epochs(timestamps)
+        values = np.asarray(values, dtype=np.float64)
+        if flags is None:
+            flags = np.zeros(len(stamps), dtype=np.int8)
+        else:
+            flags = np.asarray(flags, dtype=np.int8)
+        if not len(stamps) == len(values) == len(flags):
+            raise ValueError("columns of %d timestamps, %d values and "
+                             "%d flags differ in length" %
+                             (len(stamps), len(values), len(flags)))
+        if len(stamps) > 1 and not (stamps[1:] > stamps[:-1]).all():
+            ## sort, and keep the last of equal timestamps, as a
+            ## dictionary would.
+            order = stamps.argsort(kind='mergesort')
+            stamps, values, flags = stamps[order], values[order], flags[order]
+            last = np.append(stamps[1:] != stamps[:-1], True)
+            stamps, values, flags = stamps[last], values[last], flags[last]
+        ## the header only: the engine is built from the arrays, so
+        ## that equidistant storage may infer its step from them.
+        result = cls(**dict(kwargs, storage='columnar'))
+        if storage == 'equidistant' and isinstance(result.time_step,
+                                                   timedelta):
+            result._events = ENGINES[storage].from_arrays(
+                stamps, values, flags, step=result.time_step)
+        else:
+            result._events = ENGINES[storage].from_arrays(stamps, values,
+                                                          flags)
+        return result
+
+    ## events of a PI series collected as strings before they are
+    ## converted to arrays.
+    _XML_CHUNK = 65536
+
+    @classmethod
+    def _from_xml(cls, stream, storage=None, parser=None):
         """private function
 
         convert an open input `stream` looking like a PI file into the
@@ -341,12 +662,23 @@ class TimeSeries:
 
         not all entities are used.  in particular we do not do
         anything with `startDate` and `endDate` (we assume data starts
-        and ends at the earliest and latest events) and `timeStep`.
-
-        for `timeStep` the problem is making choices.  do we support
-        anything else than "nonequidistant"?  in Java we don't.
-
-        events are read without storing the `flag`.
+        and ends at the earliest and latest events).
+
+        a `timeStep` of fixed length becomes the `time_step` of the
+        series, and unless `storage` says otherwise, such series keep
+        their events in equidistant storage.  other series use 'dict'
+        storage by default, and 'columnar' storage if `storage` is
+        'equidistant'; so do series with events off their grid.
+
+        events are read without storing the `flag`.  events before the
+        header of their series are held until the header gives their
+        missing value; a series without header gets the default fields.
+
+        the stream is parsed incrementally: the events of a series are
+        collected while they are read and converted to arrays in chunks
+        of _XML_CHUNK events, and elements are taken out of the tree as
+        soon as they are used, so that memory does not grow with the
+        document.  `parser` names the XML parser, see piparse.PARSERS.
         """
 
         def getText(node):
@@ -357,46 +689,119 @@ class TimeSeries:
             letter with underscore + lower case letter, return
             dictionary'''
 
-            return dict((pythonify(n.tag), getText(n))
-                        for n in node.getchildren()
-                        if n.tag in set(names))
+            return dict((pythonify(local_names[n.tag]), getText(n))
+                        for n in node
+                        if local_names[n.tag] in set(names))
 
-        from xml.etree import ElementTree
-        dom = ElementTree.parse(stream)
-        convert_dom(dom)
+        def readHeader(node):
+            '''return the TimeSeries keyword arguments for the header
+            `node`'''
 
-        root = dom.getroot()
+            kwargs = fromNode(node,
+                              ['type', 'locationId', 'parameterId',
+                               'missVal', 'stationName', 'lat', 'lon',
+                               'x', 'y', 'z', 'units'])
 
-        offsetNode = root.find("timeZone")
-        offsetValue = float(getText(offsetNode))
+            time_step = None
+            for child in node:
+                if local_names[child.tag] == 'timeStep':
+                    time_step = _pi_time_step(child)
+            if time_step is not None:
+                kwargs['time_step'] = time_step
+            if storage == 'equidistant' and time_step is None:
+                ## no grid to keep the events on.
+                kwargs['storage'] = 'columnar'
+            elif storage is not None:
+                kwargs['storage'] = storage
+            elif time_step is not None:
+                kwargs['storage'] = 'equidistant'
+            else:
+                kwargs['storage'] = 'dict'
+            return kwargs
 
-        result = {}
+        def add(date, time, value):
+            '''collect the strings of an event that is not missing'''
 
-        for seriesNode in root.findall("series"):
-            headerNode = seriesNode.find("header")
+            if value != ignore_value:
+                dates.append(date)
+                times.append(time)
+                values.append(float(value))
+                if len(dates) == cls._XML_CHUNK:
+                    convert()
 
-            kwargs = fromNode(headerNode,
-                              ['type', 'locationId', 'parameterId',
-                               'missVal', 'stationName', 'lat', 'lon',
-                               'x', 'y', 'z', 'units'])
+        def convert():
+            '''move the collected event strings into arrays'''
 
-            ignore_value = kwargs.get("miss_val", None)
+            if dates:
+                stamps.append(to_datetime64(dates, times, offsetValue))
+                numbers.append(np.array(values, dtype=np.float64))
+                del dates[:], times[:], values[:]
 
-            obj = TimeSeries(**kwargs)
-            result[kwargs['location_id'], kwargs['parameter_id']] = obj
+        result = {}
+        offsetValue = 0.0
+        root = None
+
+        for action, node in piparse.iterparse(
+                stream, ('start', 'end'),
+                tags=('TimeSeries', 'timeZone', 'series', 'header', 'event'),
+                parser=parser):
+            tag = local_names[node.tag]
+
+            if action == 'start':
+                if tag == 'series':
+                    seriesNode = node
+                    kwargs = ignore_value = None
+                    dates, times, values = [], [], []
+                    stamps, numbers = [], []
+                    ## events read before the header.
+                    early = []
+                elif root is None:
+                    ## the root, from which complete series are taken.
+                    root = node
+                continue
 
-            for eventNode in seriesNode.findall("event"):
-                date = eventNode.attrib["date"]
-                time = eventNode.attrib["time"]
-                attr_value = eventNode.attrib["value"]
-                if attr_value != ignore_value:
-                    value = float(attr_value)
-                    obj[str_to_datetime(date, time, offsetValue)] = value
+            if tag == 'event':
+                attrib = node.attrib
+                if kwargs is None:
+                    ## the missing value is not known yet.
+                    early.append((attrib["date"], attrib["time"],
+                                  attrib["value"]))
+                else:
+                    add(attrib["date"], attrib["time"], attrib["value"])
+                seriesNode.remove(node)
+
+            elif tag == 'header':
+                kwargs = readHeader(node)
+                ignore_value = kwargs.get("miss_val", None)
+                for event in early:
+                    add(*event)
+                early = None
+
+            elif tag == 'series':
+                ## the series is complete: build it, and drop it from
+                ## the tree.
+                if kwargs is None:
+                    kwargs = readHeader([])
+                    for event in early:
+                        add(*event)
+                convert()
+                obj = TimeSeries.from_arrays(
+                    np.concatenate(stamps or [np.zeros(0, 'datetime64[us]')]),
+                    np.concatenate(numbers or [np.zeros(0)]), **kwargs)
+                result[obj.location_id, obj.parameter_id] = obj
+                stamps = numbers = None
+                if root is not None:
+                    root.remove(node)
+                else:
+                    node.clear()
+
+            elif tag == 'timeZone':
+                offsetValue = float(getText(node))
 
         return result
 
     @classmethod
-    def _from_django_QuerySet(cls, qs, start, end):
+    def _from_django_QuerySet(cls, qs, start, end, storage=None):
         """private function
 
         convert a django QuerySet to a result described in as_dict.
@@ -408,7 +813,7 @@ class TimeSeries:
 
         result = {}
         for series in qs:
-            obj = TimeSeries()
+            obj = TimeSeries(storage=storage or 'dict')
             event = None
             event_set = series.event_set.all()
             if start is not None:
@@ -429,7 +834,8 @@ class TimeSeries:
         return result
 
     @classmethod
-    def as_dict(cls, input, start=None, end=None):
+    def as_dict(cls, input, start=None, end=None, storage=None,
+                parser=None):
         """convert input to collection of TimeSeries
 
         input may be (the name of) a PI file or just about anything
@@ -442,25 +848,46 @@ class TimeSeries:
         `start` and `end` can be specified so that only the desired
         data from the `input` data source is retrieved.  if this
         really happens, it depends on the data source.
+
+        `storage` names the engine holding the events of the resulting
+        TimeSeries objects, see TimeSeries.__init__.  by default,
+        series read from PI files with a fixed `timeStep` are
+        equidistant, the other ones use 'dict' storage.
+
+        `parser` names the XML parser of PI files, one of
+        piparse.PARSERS; by default the fastest one installed.
         """
 
         if (isinstance(input, str) or hasattr(input, 'read')):
             ## a string or a file, maybe PI?
-            result = cls._from_xml(input)
+            result = cls._from_xml(input, storage, parser)
         elif hasattr(input, 'count') or hasattr(input, 'raw_query'):
             ## a django.db.models.query.QuerySet?
-            result = cls._from_django_QuerySet(input, start, end)
+            result = cls._from_django_QuerySet(input, start, end, storage)
         else:
             result = None
 
         return result
 
     @classmethod
-    def as_list(cls, input):
+    def as_lazy_dict(cls, input, storage=None, parser=None):
+        """return the TimeSeries of a PI file, read when first asked for
+
+        `input` is the name of a PI file or the open file.  the result
+        is a read only dictionary like the one returned by as_dict, but
+        only the headers of the series are read up front: the events of
+        a series are read the first time it is looked up.
+        """
+
+        from pilazy import LazySeriesDict
+        return LazySeriesDict(input, storage, parser)
+
+    @classmethod
+    def as_list(cls, input, storage=None, parser=None):
         """convert input to collection of TimeSeries
         """
 
-        content = cls.as_dict(input)
+        content = cls.as_dict(input, storage=storage, parser=parser)
         return [content[key] for key in sorted(content.keys())]
 
     @classmethod
@@ -468,8 +895,8 @@ class TimeSeries:
         """write TimeSeries to a PI-format file.
 
         `data` is a collection of TimeSeries objects, anything like
-        `set`, `dict` or `list` should be good enough, as long as the
-        content is TimeSeries.
+        `set`, `dict` (or other mapping) or `list` should be good
+        enough, as long as the content is TimeSeries.
 
         `dest` is the complete path of the file to be written.  or it
         is a stream to which we can write.
@@ -484,7 +911,7 @@ class TimeSeries:
         for closing it.  it is only used if `dest` is a stream.
         """
 
-        if (isinstance(data, dict)):
+        if (isinstance(data, Mapping)):
             data = [data[key] for key in sorted(data.keys())]
 
         ## create xml document and add it its root element
@@ -568,15 +995,23 @@ http://fews.wldelft.nl/schemas/version1.0/pi-schemas/pi_timeseries.xsd",
         _append_element_to(header, 'type', self.type)
         _append_element_to(header, 'locationId', self.location_id)
         _append_element_to(header, 'parameterId', self.parameter_id)
-        _append_element_to(header, 'timeStep', attrib={
-            'unit': 'nonequidistant'
-        })
+        ## only events still on their grid are written as equidistant.
+        step = getattr(self._events, 'step', None)
+        if step is not None:
+            _append_element_to(header, 'timeStep', attrib=_pi_step_attrib(
+                step))
+        else:
+            _append_element_to(header, 'timeStep', attrib={
+                'unit': 'nonequidistant'
+            })
+        start_date = self.get_start_date() + offset
+        end_date = self.get_end_date() + offset
         _append_element_to(header, 'startDate', attrib={
-            'date': (self.get_start_date() + offset).strftime("%Y-%m-%d"),
-            'time': (self.get_start_date() + offset).strftime("%H:%M:%S")})
+            'date': start_date.strftime("%Y-%m-%d"),
+            'time': start_date.strftime("%H:%M:%S")})
         _append_element_to(header, 'endDate', attrib={
-            'date': (self.get_end_date() + offset).strftime("%Y-%m-%d"),
-            'time': (self.get_end_date() + offset).strftime("%H:%M:%S")})
+            'date': end_date.strftime("%Y-%m-%d"),
+            'time': end_date.strftime("%H:%M:%S")})
         _append_element_to(header, 'missVal', str(self.miss_val))
         _append_element_to(header, 'stationName', self.station_name)
         _append_element_to(header, 'units', self.units)
@@ -598,27 +1033,187 @@ http://fews.wldelft.nl/schemas/version1.0/pi-schemas/pi_timeseries.xsd",
         """return all items, sorted by key
         """
 
-        return sorted(self._events.items())
+        events = self._events
+        return [(k, events[k]) for k in events.sorted_keys()]
+
+    def to_arrays(self):
+        """return (timestamps, values, flags) arrays, sorted by timestamp
+
+        timestamps are numpy datetime64[us], values float64, flags
+        int8.  the arrays are read-only views of the storage, not
+        copies: with columnar storage, changes to the events of self
+        show through them.
+        """
+
+        stamps, values, flags = self._events.arrays()
+        return stamps.view('datetime64[us]'), values, flags
+
+    ## a numpy scalar or array on the left of an arithmetic operator
+    ## would otherwise read self through __array__ and return a bare
+    ## array: this makes numpy leave the operation to __radd__ & co.
+    __array_priority__ = 20
+
+    def __array__(self, dtype=None):
+        """let numpy read the values of self, as by to_arrays
+        """
+
+        values = self._events.arrays()[1]
+        if dtype is not None:
+            values = values.astype(dtype, copy=False)
+        return values
+
+    def resample(self, period, how='sum'):
+        """return a TimeSeries with one event per calendar period
+
+        `period` is one of 'day', 'month', 'quarter', 'hydro_year'
+        (starting in October) and 'year'; `how` one of 'sum', 'mean',
+        'min', 'max' and 'count'.  each event is placed at the start
+        of its period; missing (nan) values are left out.
+
+        the periods of all timestamps are computed at once, and the
+        values are reduced per period by numpy segment reductions.
+        """
+
+        stamps, values = self._events.arrays()[:2]
+        keys, edges = periods.segments(periods.period_starts(stamps, period))
+        result = self.clone()
+        if period == 'day':
+            result.time_step = timedelta(1)
+        else:
+            result.time_step = ''
+        ## equidistant results are on the grid of the period, if that
+        ## is fixed; periods of calendar length are irregular.
+        engine, kwargs = self._events.__class__, {}
+        if engine is ENGINES['equidistant']:
+            if period == 'day':
+                kwargs['step'] = result.time_step
+            else:
+                engine = ENGINES['columnar']
+        result._events = engine.from_arrays(
+            keys.view(np.int64),
+            periods.reduce_segments(values, edges, how),
+            np.zeros(len(keys), dtype=np.int8), **kwargs)
+        return result
+
+    def rolling(self, window, how='sum', min_count=None):
+        """return a TimeSeries of `how` over a trailing window
+
+        `window` is either a number of consecutive events or a
+        timedelta: the window of an event at t then holds the events
+        in (t - window, t].  `how` is one of 'sum', 'mean', 'min',
+        'max' and 'count'.  missing (nan) values are left out, and
+        events whose window holds less than `min_count` values are
+        dropped.  `min_count` defaults to a full window for a number of
+        events and to 1 for a timedelta.
+
+        the cost is linear in the number of events, whatever the
+        width of the window.
+        """
+
+        stamps, values = self._events.arrays()[:2]
+        starts, min_count = self._window_starts(stamps, window, min_count)
+        return self._windowed(
+            stamps, windows.rolling(values, starts, how, min_count))
+
+    def rolling_percentile(self, window, percentile, min_count=None):
+        """return a TimeSeries of `percentile` over a trailing window
+
+        `window` and `min_count` are as for `rolling`; `percentile` is
+        in [0, 100] and interpolated as by `np.percentile`.  the window
+        is kept sorted in two heaps, so that each event costs time
+        logarithmic in the width of the window.
+        """
+
+        stamps, values = self._events.arrays()[:2]
+        starts, min_count = self._window_starts(stamps, window, min_count)
+        return self._windowed(stamps, windows.rolling_percentile(
+            values, starts, percentile, min_count))
+
+    @staticmethod
+    def _window_starts(stamps, window, min_count):
+        """return window starts and minimum count for `rolling`
+        """
+
+        if isinstance(window, timedelta):
+            if window <= timedelta(0):
+                raise ValueError("window of %s, a positive duration is "
+                                 "needed" % window)
+            duration = np.timedelta64(window).astype('timedelta64[us]')
+            starts = windows.starts_by_duration(stamps,
+                                                duration.astype(np.int64))
+            if min_count is None:
+                min_count = 1
+        else:
+            if window < 1:
+                raise ValueError("window of %s events, at least 1 is "
+                                 "needed" % window)
+            starts = windows.starts_by_count(len(stamps), window)
+            if min_count is None:
+                min_count = window
+        return starts, min_count
+
+    def _windowed(self, stamps, values):
+        """return a clone holding `values` at `stamps`, where not nan
+        """
+
+        kept = ~np.isnan(values)
+        result = self.clone()
+        kwargs = {}
+        if self._events.__class__ is ENGINES['equidistant']:
+            kwargs['step'] = self._events.step
+        result._events = self._events.from_arrays(
+            stamps[kept], values[kept],
+            np.zeros(np.count_nonzero(kept), dtype=np.int8), **kwargs)
+        return result
 
     def __eq__(self, other):
         """series equal if all fields equal, included events
         """
 
-        for k in dir(self):
-            v = getattr(self, k)
-            if type(v) not in [str, int, float, bool]:
-                continue
-            if v != getattr(other, k, None):
-                return False
+        return self.equals(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def equals(self, other, tolerance=None):
+        """series equal if all header fields equal, included events
+
+        event values are equal if they differ at most `tolerance`, or
+        if they are exactly equal if `tolerance` is None.  missing
+        (nan) values equal each other.
+        """
+
+        if (self._header != getattr(other, '_header', None) or
+                getattr(self, 'is_locf', None) !=
+                getattr(other, 'is_locf', None)):
+            return False
         if len(self) != len(other):
             return False
-        for (a, b) in zip(
-            self.sorted_event_items(),
-            other.sorted_event_items(),
-        ):
-            if a != b:
-                return False
-        return True
+        mine = getattr(self, '_events', None)
+        yours = getattr(other, '_events', None)
+        if not (hasattr(mine, 'arrays') and hasattr(yours, 'arrays')):
+            return self.sorted_event_items() == other.sorted_event_items()
+
+        try:
+            stamps, values, flags = mine.arrays()
+            other_stamps, other_values, other_flags = yours.arrays()
+        except (TypeError, ValueError):
+            ## values that are not numbers.
+            return self.sorted_event_items() == other.sorted_event_items()
+        if not (np.array_equal(stamps, other_stamps) and
+                np.array_equal(flags, other_flags)):
+            return False
+        if tolerance is None:
+            close = values == other_values
+        else:
+            ## equal infinities differ by nan.
+            with np.errstate(invalid='ignore'):
+                close = ((values == other_values) |
+                         (abs(values - other_values) <= tolerance))
+        close |= np.isnan(values) & np.isnan(other_values)
+        if not close.all():
+            return False
+        return mine.comments() == yours.comments()
 
     def __binop(self, other, op, null):
         """return self`op`other
@@ -631,36 +1226,102 @@ http://fews.wldelft.nl/schemas/version1.0/pi-schemas/pi_timeseries.xsd",
         not in *self*, they are added to the resulting timeseries.  if
         either *self* or *other* contain a timestamp that is not
         present in both objects, the missing value is assumed to be
-        the specified null value.
+        the specified null value.  a None null value means that only
+        the timestamps present in both objects are kept.
+
+        if *self* is_locf, the result only has the timestamps of
+        *other*, and the value of *self* at each of them is its last
+        observation at or before that timestamp.
+
+        both operands are aligned on the merged timestamp arrays, so
+        that `op` is applied once, to whole numpy arrays.
         """
 
+        if isinstance(other, LazySeries):
+            return NotImplemented
         result = self.clone()
-        keys = set(self.keys())
-        defval = (null, 0, '')
-        locf = (null, 0, '')
-        if isinstance(other, TimeSeries):
-            keys = keys.union(other.keys())
-            for key in sorted(keys):
-                try:
-                    value, flag, comment = self.get(key, locf)
-                    if self.is_locf:
-                        locf = value, flag, comment
-                        if key not in other.keys():
-                            continue
-                    result[key] = (
-                        op(value, other.get(key, defval)[0]),
-                        flag,
-                        '',
-                    )
-                except:
-                    pass
-        else:
-            for key in keys:
-                flag = self[key][1]
-                result[key] = op(self.get_value(key), other), flag, ''
-
+        kwargs = {}
+        if self._events.__class__ is ENGINES['equidistant']:
+            kwargs['step'] = self._events.step
+        result._events = self._events.from_arrays(
+            *self.__combine(other, op, null), **kwargs)
         return result
 
+    def __ibinop(self, other, op, null):
+        """self`op`=other, see __binop
+
+        the events of `self` are replaced, reusing its storage.
+        """
+
+        if isinstance(other, LazySeries):
+            return NotImplemented
+        combined = self.__combine(other, op, null)
+        try:
+            self._events.assign(*combined)
+        except OffGridError:
+            self._leave_grid()
+            self._events.assign(*combined)
+        return self
+
+    def __combine(self, other, op, null):
+        """return (timestamps, values, flags) arrays of self`op`other
+
+        see __binop
+        """
+
+        stamps, values, flags, numeric = self._events.numeric_arrays()
+        if null is None:
+            fill = np.nan
+        else:
+            fill = null
+        ## where the value of either operand is not a number (None, a
+        ## string) the operation fails, and no event is produced.
+        valid = []
+        if isinstance(other, TimeSeries) and self.is_locf:
+            (keys, other_values, other_flags,
+             other_numeric) = other._events.numeric_arrays()
+            if null is None:
+                ## nothing to carry forward before the first observation
+                if len(stamps):
+                    keep = keys >= stamps[0]
+                else:
+                    keep = np.zeros(len(keys), dtype=bool)
+                keys, other_values = keys[keep], other_values[keep]
+                if other_numeric is not None:
+                    other_numeric = other_numeric[keep]
+            values = op(_carried(keys, stamps, values, fill), other_values)
+            flags = _carried(keys, stamps, flags, 0)
+            if numeric is not None:
+                valid.append(_carried(keys, stamps, numeric, True))
+            if other_numeric is not None:
+                valid.append(other_numeric)
+        elif isinstance(other, TimeSeries):
+            (other_stamps, other_values, other_flags,
+             other_numeric) = other._events.numeric_arrays()
+            if null is None:
+                ## a missing value can't take part in the operation:
+                ## only the timestamps present in both are kept.
+                keys = np.intersect1d(stamps, other_stamps)
+            else:
+                keys = np.union1d(stamps, other_stamps)
+            values = op(_aligned(keys, stamps, values, fill),
+                        _aligned(keys, other_stamps, other_values, fill))
+            flags = _aligned(keys, stamps, flags, 0)
+            if numeric is not None:
+                valid.append(_aligned(keys, stamps, numeric, True))
+            if other_numeric is not None:
+                valid.append(_aligned(keys, other_stamps, other_numeric,
+                                      True))
+        else:
+            keys = stamps
+            values = op(values, other)
+            if numeric is not None:
+                valid.append(numeric)
+        if valid:
+            kept = np.logical_and.reduce(valid)
+            keys, values, flags = keys[kept], values[kept], flags[kept]
+        return keys, values, flags
+
     def __mul__(self, other):
         """implement multiplication
         """
@@ -699,33 +1360,50 @@ http://fews.wldelft.nl/schemas/version1.0/pi-schemas/pi_timeseries.xsd",
 
         return self.__mul__(other)
 
+    def __iadd__(self, other):
+        """implement in-place addition
+        """
+
+        return self.__ibinop(other, operator.add, 0)
+
+    def __isub__(self, other):
+        """implement in-place subtraction
+        """
+
+        return self.__ibinop(other, operator.sub, 0)
+
+    def __imul__(self, other):
+        """implement in-place multiplication
+        """
+
+        return self.__ibinop(other, operator.mul, None)
+
     def __abs__(self):
         """absolute values"""
-        result = self.clone(with_events=True)
-        for k in set(result._events):
-            value = list(result.get_event(k))
-            value[0] = abs(value[0])
-            result[k] = tuple(value)
-        return result
+        return self.clone(with_events=True).apply(abs)
+
+    def apply(self, func):
+        """replace values by func(values), in place.  return self
+
+        `func` receives the array of all values and returns the array
+        of new values, like numpy ufuncs do.  flags and comments are
+        kept.
+        """
+
+        self._events.apply(func)
+        return self
 
     def clone(self, with_events=False):
         """return a copy of self
         """
 
-        result = TimeSeries(type=self.type,
-                            location_id=self.location_id,
-                            parameter_id=self.parameter_id,
-                            time_step=self.time_step,
-                            miss_val=self.miss_val,
-                            station_name=self.station_name,
-                            lat=self.lat,
-                            lon=self.lon,
-                            x=self.x,
-                            y=self.y,
-                            z=self.z,
-                            units=self.units)
+        result = TimeSeries()
+        result._header = self._header
         if with_events:
-            result._events = dict(self._events)
+            result._events = self._events.copy()
+        else:
+            ## empty events, of the same engine (and grid) as self.
+            result._events = self._events.take(slice(0, 0))
         return result
 
     def keys(self):
@@ -733,3 +1411,150 @@ http://fews.wldelft.nl/schemas/version1.0/pi-schemas/pi_timeseries.xsd",
         """
 
         return self._events.keys()
+
+    def lazy(self):
+        """return a LazySeries wrapping self
+
+        arithmetic on the returned object is deferred until its
+        `evaluate` method is called.
+        """
+
+        return LazySeries(self)
+
+
+class LazySeries(object):
+    """deferred arithmetic on TimeSeries objects
+
+    operators on a LazySeries build an expression tree over TimeSeries
+    objects and constants instead of computing every intermediate
+    TimeSeries.  `evaluate` aligns all series in the tree once, on the
+    union of their timestamps, and computes the result in a single
+    pass over the aligned arrays.  the result is the same TimeSeries
+    the equivalent eager expression gives.
+
+    >>> a = TimeSeries({datetime(2011, 1, 1): (2.0, 0, ''),
+    ...                 datetime(2011, 1, 2): (4.0, 0, '')})
+    >>> b = TimeSeries({datetime(2011, 1, 2): (1.0, 0, '')})
+    >>> (a.lazy() * 0.5 + b - a).evaluate().get_values()
+    [(datetime.datetime(2011, 1, 1, 0, 0), -1.0), (datetime.datetime(2011, 1, 2, 0, 0), -1.0)]
+    """
+
+    def __init__(self, series=None, op=None, null=None,
+                 left=None, right=None):
+        ## leaves wrap a series, nodes combine `left` and `right`
+        ## operands (LazySeries or constants) through `op`.
+        self.series = series
+        self.op = op
+        self.null = null
+        self.left = left
+        self.right = right
+
+    @staticmethod
+    def _node(op, null, left, right):
+        if isinstance(left, TimeSeries):
+            left = LazySeries(left)
+        if isinstance(right, TimeSeries):
+            right = LazySeries(right)
+        return LazySeries(op=op, null=null, left=left, right=right)
+
+    def __add__(self, other):
+        return self._node(operator.add, 0, self, other)
+
+    def __radd__(self, other):
+        return self._node(operator.add, 0, other, self)
+
+    def __sub__(self, other):
+        return self._node(operator.sub, 0, self, other)
+
+    def __rsub__(self, other):
+        return self._node(operator.sub, 0, other, self)
+
+    def __mul__(self, other):
+        return self._node(operator.mul, None, self, other)
+
+    def __rmul__(self, other):
+        return self._node(operator.mul, None, other, self)
+
+    def __abs__(self):
+        return self._node(abs, None, self, None)
+
+    def _leaves(self):
+        """yield the TimeSeries in the tree, leftmost first
+        """
+
+        if self.series is not None:
+            yield self.series
+        for operand in (self.left, self.right):
+            if isinstance(operand, LazySeries):
+                for series in operand._leaves():
+                    yield series
+
+    def evaluate(self):
+        """return the TimeSeries this expression stands for
+        """
+
+        leaves = list(self._leaves())
+        grid = np.unique(np.concatenate(
+            [series._events.arrays()[0] for series in leaves]))
+        values, present, flags = self._evaluate(grid, {})
+        first = leaves[0]
+        result = first.clone()
+        kwargs = {}
+        if first._events.__class__ is ENGINES['equidistant']:
+            kwargs['step'] = first._events.step
+        result._events = first._events.from_arrays(
+            grid[present], values[present], flags[present], **kwargs)
+        return result
+
+    def _evaluate(self, grid, aligned):
+        """return (values, present, flags) arrays over `grid`
+
+        `aligned` caches the arrays of the leaves, by id.
+        """
+
+        if self.series is not None:
+            key = id(self.series)
+            if key not in aligned:
+                stamps, values, flags = self.series._events.arrays()
+                present = _aligned(grid, stamps,
+                                   np.ones(len(stamps), dtype=bool), False)
+                aligned[key] = (_aligned(grid, stamps, values, 0),
+                                present, _aligned(grid, stamps, flags, 0))
+            return aligned[key]
+
+        if self.right is None:
+            values, present, flags = self.left._evaluate(grid, aligned)
+            return self.op(values), present, flags
+
+        if not isinstance(self.left, LazySeries):
+            values, present, flags = self.right._evaluate(grid, aligned)
+            return self.op(self.left, values), present, flags
+
+        if not isinstance(self.right, LazySeries):
+            values, present, flags = self.left._evaluate(grid, aligned)
+            return self.op(values, self.right), present, flags
+
+        right, right_present, right_flags = self.right._evaluate(
+            grid, aligned)
+        if self.left.series is not None and self.left.series.is_locf:
+            ## last observation of left carried forward to the
+            ## timestamps of right, as TimeSeries.__binop does.
+            stamps, values, flags = self.left.series._events.arrays()
+            if len(stamps):
+                present = right_present & ((grid >= stamps[0]) |
+                                           (self.null is not None))
+            else:
+                present = right_present & (self.null is not None)
+            values = self.op(_carried(grid, stamps, values, 0),
+                             np.where(right_present, right, 0))
+            return values, present, _carried(grid, stamps, flags, 0)
+
+        left, left_present, left_flags = self.left._evaluate(grid, aligned)
+        if self.null is None:
+            present = left_present & right_present
+        else:
+            present = left_present | right_present
+            left = np.where(left_present, left, self.null)
+            right = np.where(right_present, right, self.null)
+        flags = np.where(left_present, left_flags, 0)
+        return self.op(left, right), present, flags
@@ -29,13 +29,22 @@
 from unittest import TestCase
 from timeseries import TimeSeries
 from timeseries import str_to_datetime
+from timeseries import convert_dom
 from timeseries import _append_element_to
+from storage import ENGINES
+import piparse
+import pilazy
 import pkg_resources
 from datetime import datetime, timedelta
 from xml.etree import ElementTree
 from nens import mock
+import io
 import os
 import logging
+import pickle
+from StringIO import StringIO
+
+import numpy as np
 
 
 class django:
@@ -304,6 +313,15 @@ class TestUtilityFunctions(TestCase):
         self.assertEquals(datetime(2012, 02, 29, 20),
                           str_to_datetime("2012-03-01", "00:00:00", 4))
 
+    def test005(self):
+        'str_to_datetime, malformed input'
+        self.assertEquals(datetime(2010, 4, 3, 1, 2),
+                          str_to_datetime("2010-4-3", "01:02:00"))
+        self.assertRaises(ValueError, str_to_datetime,
+                          "2010-04-31", "00:00:00")
+        self.assertRaises(ValueError, str_to_datetime,
+                          "2010-04-03", "0:00:00 ")
+
 
 class TimeSeriesInput(TestCase):
 
@@ -322,6 +340,88 @@ class TimeSeriesInput(TestCase):
         obj = TimeSeries.as_dict(stream)
         self.assertTrue(isinstance(obj, dict))
 
+    def test006(self):
+        'TimeSeries.as_dict reads series from a stream without namespace'
+        stream = StringIO(
+            '<TimeSeries><timeZone>1.0</timeZone>'
+            '<series><header><locationId>a</locationId>'
+            '<parameterId>p</parameterId><missVal>-9</missVal></header>'
+            '<event date="2010-04-03" time="01:00:00" value="-9"/>'
+            '<event date="2010-04-03" time="02:00:00" value="3.5"/>'
+            '</series><series><header><locationId>b</locationId>'
+            '<parameterId>p</parameterId></header>'
+            '<event date="2010-04-03" time="02:00:00" value="4"/>'
+            '</series></TimeSeries>')
+        obj = TimeSeries.as_dict(stream)
+        self.assertEquals([(datetime(2010, 4, 3, 1), (3.5, 0, ''))],
+                          obj['a', 'p'].get_events())
+        self.assertEquals([(datetime(2010, 4, 3, 1), (4.0, 0, ''))],
+                          obj['b', 'p'].get_events())
+
+    def test0065(self):
+        'convert_dom strips namespaces from all tags'
+        dom = ElementTree.ElementTree(ElementTree.fromstring(
+            '<TimeSeries xmlns="http://www.wldelft.nl/fews/PI">'
+            '<series><header/><extra xmlns="urn:other"/></series>'
+            '</TimeSeries>'))
+        convert_dom(dom)
+        self.assertEquals(['TimeSeries', 'series', 'header', 'extra'],
+                          [e.tag for e in dom.getroot().iter()])
+
+    def test0067(self):
+        'TimeSeries.as_dict gives the same series with every parser'
+        reference = TimeSeries.as_dict(
+            self.testdata + "read.PI.timezone.2.xml", parser='ElementTree')
+        for parser in piparse.available_parsers():
+            obj = TimeSeries.as_dict(
+                self.testdata + "read.PI.timezone.2.xml", parser=parser)
+            self.assertEquals(reference, obj)
+        if 'lxml' not in piparse.available_parsers():
+            self.assertRaises(ValueError, TimeSeries.as_dict,
+                              self.testdata + "read.PI.timezone.2.xml",
+                              parser='lxml')
+
+    def test0068(self):
+        'TimeSeries.as_dict reads dates without zero padding'
+        stream = StringIO(
+            '<TimeSeries><timeZone>1.0</timeZone>'
+            '<series><header><locationId>a</locationId>'
+            '<parameterId>p</parameterId></header>'
+            '<event date="2010-04-03" time="01:00:00" value="2"/>'
+            '<event date="2010-4-3" time="02:00:00" value="3"/>'
+            '</series></TimeSeries>')
+        obj = TimeSeries.as_dict(stream)
+        self.assertEquals([(datetime(2010, 4, 3, 0), (2.0, 0, '')),
+                           (datetime(2010, 4, 3, 1), (3.0, 0, ''))],
+                          obj['a', 'p'].get_events())
+
+    def test0069(self):
+        'TimeSeries.as_dict converts events in chunks'
+        expected = TimeSeries.as_dict(self.testdata + "read.PI.timezone.2.xml")
+        chunk, TimeSeries._XML_CHUNK = TimeSeries._XML_CHUNK, 2
+        try:
+            current = TimeSeries.as_dict(
+                self.testdata + "read.PI.timezone.2.xml")
+        finally:
+            TimeSeries._XML_CHUNK = chunk
+        self.assertEquals(expected, current)
+
+    def test0070(self):
+        'TimeSeries.as_dict reads events that come before their header'
+        stream = StringIO(
+            '<TimeSeries><timeZone>1.0</timeZone><series>'
+            '<event date="2010-04-03" time="01:00:00" value="-9"/>'
+            '<event date="2010-04-03" time="02:00:00" value="3.5"/>'
+            '<header><locationId>a</locationId>'
+            '<parameterId>p</parameterId><missVal>-9</missVal></header>'
+            '<event date="2010-04-03" time="03:00:00" value="-9"/>'
+            '<event date="2010-04-03" time="04:00:00" value="4"/>'
+            '</series></TimeSeries>')
+        obj = TimeSeries.as_dict(stream)
+        self.assertEquals([(datetime(2010, 4, 3, 1), (3.5, 0, '')),
+                           (datetime(2010, 4, 3, 3), (4.0, 0, ''))],
+                          obj['a', 'p'].get_events())
+
     def test007(self):
         'TimeSeries.as_dict receiving unrecognized object, returns None'
         self.assertEquals(None, TimeSeries.as_dict(None))
@@ -999,3 +1099,1226 @@ class TimeSeriesSubsetting(TestCase):
         self.assertEquals(self.a, b)
         b = self.a.filter(timestamp_gt=self.d1, timestamp_lt=self.d2)
         self.assertEquals(1, len(b))
+
+
+class TimeSeriesColumnarStorage(TestCase):
+    def setUp(self):
+        self.testdata = pkg_resources.resource_filename(
+            "timeseries", "testdata/")
+        obj = TimeSeries(location_id='loc', parameter_id='par',
+                         storage='columnar')
+        self.d1 = datetime(1979, 3, 15, 9, 35)
+        self.d3 = datetime(1979, 4, 12, 9, 35)
+        self.d2 = datetime(1979, 5, 15, 9, 35)
+        obj[self.d1] = 1.23
+        obj[self.d2] = -3.01
+        obj[self.d3] = 0.23
+
+        self.a = obj
+
+    def test000(self):
+        'columnar storage behaves as a dictionary'
+
+        self.assertEquals((1.23, 0, ''), self.a[self.d1])
+        self.assertEquals(-3.01, self.a.get_value(self.d2))
+        self.assertEquals(None, self.a.get(datetime(1979, 1, 1)))
+        self.assertEquals(3, len(self.a))
+        self.assertEquals([self.d1, self.d3, self.d2], self.a.keys())
+
+    def test010(self):
+        'columnar storage returns sorted events'
+
+        self.assertEquals([(self.d1, (1.23, 0, '')),
+                           (self.d3, (0.23, 0, '')),
+                           (self.d2, (-3.01, 0, ''))],
+                          self.a.get_events())
+        self.assertEquals(self.a.get_events(), self.a.sorted_event_items())
+
+    def test020(self):
+        'columnar storage keeps flags and comments'
+
+        self.a[self.d3] = (0.5, 6, 'checked')
+        self.a[self.d1] = 2.0
+        self.assertEquals((0.5, 6, 'checked'), self.a[self.d3])
+        self.assertEquals((2.0, 0, ''), self.a[self.d1])
+
+    def test030(self):
+        'columnar storage allows deleting events'
+
+        del self.a[self.d3]
+        self.assertEquals([self.d1, self.d2], self.a.keys())
+        self.assertRaises(KeyError, self.a.__delitem__, self.d3)
+
+    def test040(self):
+        'cloning keeps the storage engine'
+
+        current = self.a.clone(with_events=True)
+        self.assertEquals(self.a, current)
+        current[self.d1] = 0
+        self.assertEquals(1.23, self.a.get_value(self.d1))
+        self.assertEquals(0, len(self.a.clone()))
+        self.assertEquals(self.a._events.__class__,
+                          self.a.clone()._events.__class__)
+
+    def test100(self):
+        'TimeSeries.as_dict reads to columnar storage'
+
+        expect = TimeSeries.as_dict(self.testdata + "read.PI.timezone.2.xml")
+        current = TimeSeries.as_dict(self.testdata + "read.PI.timezone.2.xml",
+                                     storage='columnar')
+        self.assertEquals(set(expect.keys()), set(current.keys()))
+        for key in expect:
+            self.assertEquals(expect[key], current[key])
+
+
+class TimeSeriesSortedIndex(TestCase):
+    def setUp(self):
+        obj = TimeSeries(location_id='loc', parameter_id='par')
+        self.d1 = datetime(1979, 3, 15, 9, 35)
+        self.d3 = datetime(1979, 4, 12, 9, 35)
+        self.d2 = datetime(1979, 5, 15, 9, 35)
+        obj[self.d1] = 1.23
+        obj[self.d3] = 0.23
+        obj[self.d2] = -3.01
+
+        self.a = obj
+
+    def test000(self):
+        'sorted index follows events added in order'
+
+        self.assertEquals([self.d1, self.d3, self.d2],
+                          self.a._events.sorted_keys())
+        d4 = self.d2 + timedelta(1)
+        self.a[d4] = 1
+        self.assertEquals([self.d1, self.d3, self.d2, d4],
+                          self.a._events.sorted_keys())
+
+    def test010(self):
+        'sorted index follows events added out of order'
+
+        self.a.get_events()
+        d0 = self.d1 - timedelta(1)
+        self.a[d0] = 1
+        self.assertEquals([self.d1, self.d3, self.d2],
+                          [k for (k, v) in self.a.get_events(self.d1)])
+        self.assertEquals([d0, self.d1, self.d3, self.d2],
+                          [k for (k, v) in self.a.sorted_event_items()])
+
+    def test020(self):
+        'sorted index follows removed events'
+
+        self.a.get_events()
+        del self.a[self.d3]
+        self.assertEquals([self.d1, self.d2],
+                          [k for (k, v) in self.a.sorted_event_items()])
+        b = self.a.filter(timestamp_gt=self.d1)
+        self.assertEquals([self.d2], [k for (k, v) in b.get_events()])
+        self.assertEquals([self.d1, self.d2],
+                          [k for (k, v) in self.a.get_events()])
+
+
+class TimeSeriesWindows(TestCase):
+    def setUp(self):
+        self.start = datetime(2000, 1, 1)
+        self.series = []
+        for storage in ['dict', 'columnar']:
+            obj = TimeSeries(location_id='loc', parameter_id='par',
+                             storage=storage)
+            for i in range(100):
+                obj[self.start + timedelta(i)] = float(i)
+            self.series.append(obj)
+
+    def test000(self):
+        'window boundaries are inclusive'
+
+        for obj in self.series:
+            current = obj.get_events(self.start + timedelta(10),
+                                     self.start + timedelta(12))
+            self.assertEquals([10.0, 11.0, 12.0],
+                              [v[0] for (k, v) in current])
+
+    def test010(self):
+        'window boundaries need not match timestamps'
+
+        for obj in self.series:
+            current = obj.get_events(self.start + timedelta(9.5),
+                                     self.start + timedelta(12.5))
+            self.assertEquals([10.0, 11.0, 12.0],
+                              [v[0] for (k, v) in current])
+            self.assertEquals(5, len(obj.get_events(self.start + timedelta(95))))
+            self.assertEquals(0, len(obj.get_events(self.start + timedelta(200))))
+            self.assertEquals(1, len(obj.get_events(end_date=self.start)))
+
+    def test020(self):
+        'selecting events on given dates'
+
+        dates = [self.start + timedelta(3), self.start + timedelta(1),
+                 self.start + timedelta(1), self.start - timedelta(1)]
+        for obj in self.series:
+            current = obj.get_events(dates=dates)
+            self.assertEquals([(self.start + timedelta(1), (1.0, 0, '')),
+                               (self.start + timedelta(3), (3.0, 0, ''))],
+                              current)
+
+
+class TimeSeriesBounds(TestCase):
+    def setUp(self):
+        self.d1 = datetime(1979, 3, 15, 9, 35)
+        self.d3 = datetime(1979, 4, 12, 9, 35)
+        self.d2 = datetime(1979, 5, 15, 9, 35)
+
+    def test000(self):
+        'bounds follow inserted events'
+
+        for storage in ['dict', 'columnar']:
+            obj = TimeSeries(storage=storage)
+            obj[self.d3] = 0.23
+            self.assertEquals(self.d3, obj.get_start_date())
+            self.assertEquals(self.d3, obj.get_end_date())
+            obj[self.d2] = -3.01
+            obj[self.d1] = 1.23
+            self.assertEquals(self.d1, obj.get_start_date())
+            self.assertEquals(self.d2, obj.get_end_date())
+
+    def test010(self):
+        'bounds follow removed events'
+
+        for storage in ['dict', 'columnar']:
+            obj = TimeSeries({self.d1: (1.23, 0, ''),
+                              self.d2: (-3.01, 0, ''),
+                              self.d3: (0.23, 0, '')}, storage=storage)
+            self.assertEquals(self.d1, obj.get_start_date())
+            del obj[self.d1]
+            self.assertEquals(self.d3, obj.get_start_date())
+            del obj[self.d2]
+            self.assertEquals(self.d3, obj.get_end_date())
+            del obj[self.d3]
+            self.assertEquals(datetime(1970, 1, 1), obj.get_start_date())
+            self.assertEquals(datetime(1970, 1, 1), obj.get_end_date())
+
+
+class TimeSeriesVectorizedOperations(TestCase):
+    def setUp(self):
+        self.d1 = datetime(1979, 3, 15, 9, 35)
+        self.d3 = datetime(1979, 4, 12, 9, 35)
+        self.d2 = datetime(1979, 5, 15, 9, 35)
+        self.a = {}
+        self.b = {}
+        for storage in ['dict', 'columnar']:
+            obj = TimeSeries(location_id='loc', parameter_id='par',
+                             storage=storage)
+            obj[self.d1] = (1.5, 2, 'x')
+            obj[self.d3] = (0.5, 3, '')
+            obj[self.d2] = (-3.0, 4, '')
+            self.a[storage] = obj
+            obj = TimeSeries(location_id='loc', parameter_id='par',
+                             storage=storage)
+            obj[self.d1] = (33.0, 6, '')
+            obj[self.d2] = (-0.25, 6, '')
+            obj[self.d2 + timedelta(1)] = (2.0, 6, '')
+            self.b[storage] = obj
+
+    def test000(self):
+        'sum takes union of keys and flags of left operand'
+
+        for storage in ['dict', 'columnar']:
+            current = self.a[storage] + self.b[storage]
+            self.assertEquals([(self.d1, (34.5, 2, '')),
+                               (self.d3, (0.5, 3, '')),
+                               (self.d2, (-3.25, 4, '')),
+                               (self.d2 + timedelta(1), (2.0, 0, ''))],
+                              current.get_events())
+            self.assertEquals(storage == 'columnar',
+                              current._events.__class__.__name__ ==
+                              'ColumnarEvents')
+
+    def test010(self):
+        'difference takes union of keys'
+
+        for storage in ['dict', 'columnar']:
+            current = self.b[storage] - self.a[storage]
+            self.assertEquals([(self.d1, (31.5, 6, '')),
+                               (self.d3, (-0.5, 0, '')),
+                               (self.d2, (2.75, 6, '')),
+                               (self.d2 + timedelta(1), (2.0, 6, ''))],
+                              current.get_events())
+
+    def test020(self):
+        'product takes intersection of keys'
+
+        for storage in ['dict', 'columnar']:
+            current = self.a[storage] * self.b[storage]
+            self.assertEquals([(self.d1, (49.5, 2, '')),
+                               (self.d2, (0.75, 4, ''))],
+                              current.get_events())
+
+    def test030(self):
+        'operations with empty timeseries'
+
+        for storage in ['dict', 'columnar']:
+            empty = TimeSeries(storage=storage)
+            self.assertEquals(self.a[storage].get_values(),
+                              (self.a[storage] + empty).get_values())
+            self.assertEquals(0, len(self.a[storage] * empty))
+            self.assertEquals(0, len(empty * 2))
+
+    def test040(self):
+        'events whose value is not a number are left out of the result'
+
+        a = self.a['dict'].clone(with_events=True)
+        a[self.d3] = (None, 3, '')
+        a[self.d2 + timedelta(1)] = ('x', 0, '')
+        current = a + self.b['dict']
+        self.assertEquals([(self.d1, (34.5, 2, '')),
+                           (self.d2, (-3.25, 4, ''))],
+                          current.get_events())
+        self.assertEquals([(self.d1, (34.5, 6, '')),
+                           (self.d2, (-3.25, 6, ''))],
+                          (self.b['dict'] + a).get_events())
+        self.assertEquals([(self.d1, (3.0, 2, '')),
+                           (self.d2, (-6.0, 4, ''))],
+                          (a * 2).get_events())
+        a.is_locf = True
+        current = a + self.b['dict']
+        self.assertEquals([(self.d1, (34.5, 2, '')),
+                           (self.d2, (-3.25, 4, ''))],
+                          current.get_events())
+        a.is_locf = False
+        a += self.b['dict']
+        self.assertEquals([(self.d1, (34.5, 2, '')),
+                           (self.d2, (-3.25, 4, ''))],
+                          a.get_events())
+
+    def test100(self):
+        'locf carries last observation of self to keys of other'
+
+        for storage in ['dict', 'columnar']:
+            a = self.a[storage].clone(with_events=True)
+            a.is_locf = True
+            b = self.b[storage].clone(with_events=True)
+            b[self.d1 - timedelta(1)] = 7.0
+            current = a + b
+            self.assertEquals([(self.d1 - timedelta(1), (7.0, 0, '')),
+                               (self.d1, (34.5, 2, '')),
+                               (self.d2, (-3.25, 4, '')),
+                               (self.d2 + timedelta(1), (-1.0, 4, ''))],
+                              current.get_events())
+            current = a * b
+            self.assertEquals([(self.d1, (49.5, 2, '')),
+                               (self.d2, (0.75, 4, '')),
+                               (self.d2 + timedelta(1), (-6.0, 4, ''))],
+                              current.get_events())
+
+    def test200(self):
+        'in-place operations reuse the storage of the left operand'
+
+        for storage in ['dict', 'columnar']:
+            a = self.a[storage]
+            events = a._events
+            expect = (a + self.b[storage]).get_events()
+            a += self.b[storage]
+            self.assertTrue(events is a._events)
+            self.assertEquals(expect, a.get_events())
+            expect = (a * 2).get_events()
+            a *= 2
+            self.assertTrue(events is a._events)
+            self.assertEquals(expect, a.get_events())
+            expect = (a - self.b[storage]).get_events()
+            a -= self.b[storage]
+            self.assertTrue(events is a._events)
+            self.assertEquals(expect, a.get_events())
+
+    def test210(self):
+        'apply and abs keep flags and comments'
+
+        for storage in ['dict', 'columnar']:
+            current = abs(self.a[storage])
+            self.assertEquals([(self.d1, (1.5, 2, 'x')),
+                               (self.d3, (0.5, 3, '')),
+                               (self.d2, (3.0, 4, ''))],
+                              current.get_events())
+            self.assertEquals(-3.0, self.a[storage].get_value(self.d2))
+            self.assertTrue(current.apply(lambda v: v * 2) is current)
+            self.assertEquals([3.0, 1.0, 6.0],
+                              [v for (k, v) in current.get_values()])
+
+    def test220(self):
+        'results of scalar operations are independent of operand'
+
+        for storage in ['dict', 'columnar']:
+            current = self.a[storage] * 2
+            current[self.d1] = (0.0, 9, '')
+            current += 1
+            self.assertEquals((1.5, 2, 'x'), self.a[storage][self.d1])
+            self.assertEquals((1.0, 9, ''), current[self.d1])
+
+    def test230(self):
+        'chained dict operations do not rebuild the column arrays'
+
+        engine = ENGINES['dict']
+        arrays = engine.__dict__['numeric_arrays']
+        rebuilt = []
+
+        def counting(events):
+            rebuilt.append(events._arrays is None)
+            return arrays(events)
+
+        def chain(a, b):
+            current = a + b
+            current += a
+            current *= 2
+            current = 1.5 - current
+            current -= b
+            return current * a
+
+        expect = chain(self.a['columnar'], self.b['columnar'])
+        a, b = self.a['dict'], self.b['dict']
+        a.to_arrays(), b.to_arrays()
+        engine.numeric_arrays = counting
+        try:
+            current = chain(a, b)
+        finally:
+            engine.numeric_arrays = arrays
+        self.assertTrue(rebuilt)
+        self.assertEquals(0, sum(rebuilt))
+        self.assertEquals(expect.get_events(), current.get_events())
+
+
+class TimeSeriesLazyOperations(TestCase):
+    def setUp(self):
+        self.d1 = datetime(1979, 3, 15, 9, 35)
+        self.d3 = datetime(1979, 4, 12, 9, 35)
+        self.d2 = datetime(1979, 5, 15, 9, 35)
+        self.a = TimeSeries(location_id='loc', parameter_id='a')
+        self.a[self.d1] = (1.5, 2, '')
+        self.a[self.d3] = (0.5, 3, '')
+        self.a[self.d2] = (-3.0, 4, '')
+        self.b = TimeSeries(location_id='loc', parameter_id='b')
+        self.b[self.d1] = (33.0, 6, '')
+        self.b[self.d2] = (-0.25, 6, '')
+        self.c = TimeSeries(location_id='loc', parameter_id='c')
+        self.c[self.d2 + timedelta(1)] = (2.0, 1, '')
+
+    def test000(self):
+        'lazy expression gives same result as eager expression'
+
+        a, b, c = self.a, self.b, self.c
+        self.assertEquals(a * 0.5 + b - c,
+                          (a.lazy() * 0.5 + b - c).evaluate())
+        self.assertEquals(a * b + c,
+                          (a.lazy() * b.lazy() + c.lazy()).evaluate())
+        self.assertEquals(2 - a * b, (2 - a.lazy() * b).evaluate())
+        self.assertEquals(c + abs(a), (c + abs(a.lazy())).evaluate())
+
+    def test010(self):
+        'lazy expression respects is_locf'
+
+        a, b = self.a.clone(with_events=True), self.b.clone(with_events=True)
+        a.is_locf = True
+        b[self.d2 + timedelta(3)] = (1.0, 0, '')
+        self.assertEquals(a + b, (a.lazy() + b).evaluate())
+        self.assertEquals(a * b, (a.lazy() * b).evaluate())
+
+    def test020(self):
+        'result of lazy expression has header of leftmost series'
+
+        current = (3 * self.b.lazy() + self.a).evaluate()
+        self.assertEquals('b', current.parameter_id)
+
+
+class TimeSeriesCopyOnWrite(TestCase):
+    def setUp(self):
+        self.d1 = datetime(1979, 3, 15, 9, 35)
+        self.d2 = datetime(1979, 4, 12, 9, 35)
+        self.d3 = datetime(1979, 5, 15, 9, 35)
+        self.a = TimeSeries(location_id='loc', parameter_id='a',
+                            storage='columnar')
+        self.a[self.d1] = (1.5, 2, '')
+        self.a[self.d2] = (0.5, 3, 'comment')
+        self.a[self.d3] = (-3.0, 4, '')
+
+    def test000(self):
+        'writing to a columnar clone does not affect the original'
+
+        b = self.a.clone(with_events=True)
+        b[self.d1] = (7.0, 1, '')
+        b.apply(abs)
+        b *= 2
+        self.assertEquals((1.5, 2, ''), self.a[self.d1])
+        self.assertEquals((-3.0, 4, ''), self.a[self.d3])
+        self.assertEquals((14.0, 1, ''), b[self.d1])
+        self.assertEquals((6.0, 4, ''), b[self.d3])
+
+    def test010(self):
+        'writing to the original does not affect a columnar clone'
+
+        b = self.a.clone(with_events=True)
+        self.a[self.d2] = (9.0, 9, '')
+        self.a.apply(abs)
+        del self.a._events[self.d1]
+        self.assertEquals((0.5, 3, 'comment'), b[self.d2])
+        self.assertEquals((-3.0, 4, ''), b[self.d3])
+        self.assertEquals(3, len(b._events))
+
+    def test020(self):
+        'filter keeps the events that satisfy all predicates'
+
+        for storage in ['dict', 'columnar']:
+            a = self.a.clone(with_events=True)
+            a._events = ENGINES[storage](self.a._events)
+            current = a.filter(timestamp_gt=self.d1, timestamp_lte=self.d3,
+                               timestamp_lt=None)
+            self.assertEquals([(self.d2, (0.5, 3, 'comment')),
+                               (self.d3, (-3.0, 4, ''))],
+                              current.get_events())
+            self.assertEquals(self.a.parameter_id, current.parameter_id)
+
+    def test030(self):
+        'a dict clone reads the events of the original until a write'
+
+        a = self.a.clone(with_events=True)
+        a._events = ENGINES['dict'](self.a._events.items())
+        b = a.clone(with_events=True)
+        self.assertEquals(dict(a._events), dict(b._events))
+        current = {}
+        current.update(b._events)
+        self.assertEquals(dict(a._events), current)
+        self.assertEquals(a.get_events(), b.get_events())
+        for protocol in [0, 2]:
+            self.assertEquals(a, pickle.loads(pickle.dumps(b, protocol)))
+        b[self.d1] = (7.0, 1, '')
+        b.apply(abs)
+        b *= 2
+        self.assertEquals((1.5, 2, ''), a[self.d1])
+        self.assertEquals((-3.0, 4, ''), a[self.d3])
+        self.assertEquals((14.0, 1, ''), b[self.d1])
+        self.assertEquals((6.0, 4, ''), b[self.d3])
+        self.assertEquals({self.d1: (14.0, 1, ''),
+                           self.d2: (1.0, 3, ''),
+                           self.d3: (6.0, 4, '')}, dict(b._events))
+
+    def test040(self):
+        'writing to the original does not affect a dict clone'
+
+        a = self.a.clone(with_events=True)
+        a._events = ENGINES['dict'](self.a._events.items())
+        b = a.clone(with_events=True)
+        c = b.clone(with_events=True)
+        a[self.d2] = (9.0, 9, '')
+        a.apply(abs)
+        del a._events[self.d1]
+        for current in [b, c]:
+            self.assertEquals((0.5, 3, 'comment'), current[self.d2])
+            self.assertEquals((-3.0, 4, ''), current[self.d3])
+            self.assertEquals(3, len(current._events))
+            self.assertEquals(current, pickle.loads(pickle.dumps(current)))
+
+
+class TimeSeriesFilter(TestCase):
+    def setUp(self):
+        self.d = [datetime(1979, 3, 15, 9, 35) + timedelta(i)
+                  for i in range(6)]
+        self.events = [(1.5, 2, ''), (0.5, 6, 'x'), (-3.0, 4, ''),
+                       (7.0, 8, ''), (2.0, 0, 'y'), (4.0, 6, '')]
+
+    def series(self, storage):
+        result = TimeSeries(location_id='loc', storage=storage)
+        for d, event in zip(self.d, self.events):
+            result[d] = event
+        return result
+
+    def test000(self):
+        'timestamp predicates select one slice'
+
+        for storage in ['dict', 'columnar']:
+            a = self.series(storage)
+            current = a.filter(timestamp_gte=self.d[1],
+                               timestamp_lt=self.d[4],
+                               timestamp_lte=self.d[5])
+            self.assertEquals(zip(self.d[1:4], self.events[1:4]),
+                              current.get_events())
+            self.assertEquals([], a.filter(timestamp_gt=self.d[3],
+                                           timestamp_lte=self.d[2]).
+                              get_events())
+
+    def test010(self):
+        'flag and value predicates are combined with timestamp predicates'
+
+        for storage in ['dict', 'columnar']:
+            a = self.series(storage)
+            current = a.filter(flag_lt=6)
+            self.assertEquals([self.d[0], self.d[2], self.d[4]],
+                              [k for (k, v) in current.get_events()])
+            current = a.filter(value_gt=1.0, flag_ne=8,
+                               timestamp_gt=self.d[0])
+            self.assertEquals(zip([self.d[4], self.d[5]],
+                                  self.events[4:]),
+                              current.get_events())
+
+    def test020(self):
+        'filtering leaves the original series unchanged'
+
+        a = self.series('columnar')
+        b = a.filter(timestamp_gte=self.d[2])
+        b[self.d[3]] = (0.0, 0, '')
+        self.assertEquals((7.0, 8, ''), a[self.d[3]])
+        self.assertEquals(6, len(a.get_events()))
+
+    def test030(self):
+        'timestamp predicates do not read the values'
+
+        a = TimeSeries(location_id='loc', storage='dict')
+        for d, value in zip(self.d, 'abcdef'):
+            a[d] = (value, 0, '')
+        current = a.filter(timestamp_gt=self.d[1], timestamp_lte=self.d[3])
+        self.assertEquals([(self.d[2], ('c', 0, '')),
+                           (self.d[3], ('d', 0, ''))],
+                          current.get_events())
+
+    def test040(self):
+        'filter rejects an unknown field'
+
+        for storage in ['dict', 'columnar']:
+            a = self.series(storage)
+            self.assertRaises(ValueError, a.filter, values_gt=1.0)
+            self.assertRaises(ValueError, a.filter, date_lt=None)
+
+
+class TimeSeriesBulkConstruction(TestCase):
+    def setUp(self):
+        self.d = [datetime(1979, 3, 15, 9, 35) + timedelta(i)
+                  for i in range(4)]
+
+    def test000(self):
+        'from_arrays adopts the value array of columnar storage'
+
+        stamps = np.array(self.d[:3], dtype='datetime64[us]')
+        values = np.array([1.0, 2.5, -1.0])
+        a = TimeSeries.from_arrays(stamps, values, location_id='loc')
+        self.assertEquals('loc', a.location_id)
+        self.assertEquals([(self.d[0], (1.0, 0, '')),
+                           (self.d[1], (2.5, 0, '')),
+                           (self.d[2], (-1.0, 0, ''))], a.get_events())
+        values[1] = 4.0
+        self.assertEquals((4.0, 0, ''), a[self.d[1]])
+
+    def test005(self):
+        'in-place changes leave the adopted arrays alone'
+
+        values = np.array([1.0, 2.0])
+        a = TimeSeries.from_arrays(self.d[:2], values)
+        b = TimeSeries.from_arrays(self.d[:2], values)
+        a += 10
+        self.assertEquals([1.0, 2.0], values.tolist())
+        self.assertEquals([(self.d[0], (1.0, 0, '')),
+                           (self.d[1], (2.0, 0, ''))], b.get_events())
+        a.apply(np.negative)
+        self.assertEquals([1.0, 2.0], values.tolist())
+        self.assertEquals([(self.d[0], (-11.0, 0, '')),
+                           (self.d[1], (-12.0, 0, ''))], a.get_events())
+        self.assertEquals([(self.d[0], (1.0, 0, '')),
+                           (self.d[1], (2.0, 0, ''))], b.get_events())
+
+    def test010(self):
+        'from_arrays sorts timestamps, last duplicate wins'
+
+        for storage in ['dict', 'columnar']:
+            a = TimeSeries.from_arrays(
+                [self.d[2], self.d[0], self.d[2]], [1.0, 2.0, 3.0],
+                [1, 2, 3], storage=storage)
+            self.assertEquals([(self.d[0], (2.0, 2, '')),
+                               (self.d[2], (3.0, 3, ''))], a.get_events())
+
+    def test015(self):
+        'from_arrays rejects columns of different lengths'
+
+        for storage in ['dict', 'columnar', 'equidistant']:
+            self.assertRaises(ValueError, TimeSeries.from_arrays,
+                              self.d[:3], [1.0, 2.0], storage=storage)
+            self.assertRaises(ValueError, TimeSeries.from_arrays,
+                              self.d[:2], [1.0, 2.0], [0, 0, 0],
+                              storage=storage)
+
+    def test020(self):
+        'extend adds a batch, keeping flags of bare values'
+
+        for storage in ['dict', 'columnar']:
+            a = TimeSeries(storage=storage)
+            a[self.d[1]] = (1.0, 6, 'c')
+            a[self.d[3]] = (2.0, 2, '')
+            a.extend([(self.d[2], (5.0, 1, 'x')),
+                      (self.d[0], 3.0),
+                      (self.d[1], 7.0)])
+            self.assertEquals([(self.d[0], (3.0, 0, '')),
+                               (self.d[1], (7.0, 6, 'c')),
+                               (self.d[2], (5.0, 1, 'x')),
+                               (self.d[3], (2.0, 2, ''))], a.get_events())
+            self.assertEquals(self.d[0], a.get_start_date())
+
+    def test030(self):
+        'update accepts a dictionary and appends in order'
+
+        for storage in ['dict', 'columnar']:
+            a = TimeSeries(storage=storage)
+            a.update({self.d[0]: (1.0, 0, '')})
+            a.update({self.d[1]: (2.0, 0, ''), self.d[2]: (3.0, 0, '')})
+            self.assertEquals(self.d[:3], [k for (k, v) in a.get_events()])
+            self.assertEquals(self.d[2], a.get_end_date())
+
+    def test040(self):
+        'dict from_arrays keeps copies of the arrays as its columns'
+
+        stamps = np.array(self.d[:3], dtype='datetime64[us]').view(np.int64)
+        values = np.array([1.0, 2.5, -1.0])
+        flags = np.array([0, 6, 2], dtype=np.int8)
+        events = ENGINES['dict'].from_arrays(stamps, values, flags)
+        columns = events._arrays
+        self.assertTrue(events.arrays() is columns)
+        self.assertEquals((self.d[0], self.d[2]), events._bounds)
+        values[1] = 4.0
+        self.assertEquals([1.0, 2.5, -1.0], columns[1].tolist())
+        self.assertEquals([0, 6, 2], columns[2].tolist())
+        events[self.d[3]] = (3.0, 1, '')
+        self.assertEquals([1.0, 2.5, -1.0, 3.0],
+                          events.arrays()[1].tolist())
+
+
+class TimeSeriesArrayExport(TestCase):
+    def setUp(self):
+        self.d = [datetime(1979, 3, 15, 9, 35) + timedelta(i)
+                  for i in range(3)]
+
+    def test000(self):
+        'to_arrays returns sorted read-only columns'
+
+        for storage in ['dict', 'columnar']:
+            a = TimeSeries(storage=storage)
+            for i in [2, 0, 1]:
+                a[self.d[i]] = (i * 1.5, i, '')
+            stamps, values, flags = a.to_arrays()
+            self.assertEquals(self.d, stamps.astype(object).tolist())
+            self.assertEquals([0.0, 1.5, 3.0], values.tolist())
+            self.assertEquals([0, 1, 2], flags.tolist())
+            self.assertRaises(ValueError, values.__setitem__, 0, 1.0)
+
+    def test010(self):
+        'columnar to_arrays shares memory with the storage'
+
+        a = TimeSeries.from_arrays(self.d, [1.0, 2.0, 3.0])
+        self.assertTrue(np.may_share_memory(a.to_arrays()[1],
+                                            a._events._values))
+
+    def test020(self):
+        'numpy reads the values of a TimeSeries'
+
+        a = TimeSeries.from_arrays(self.d, [1.0, 2.0, 3.0],
+                                   storage='dict')
+        self.assertEquals([1.0, 2.0, 3.0], np.asarray(a).tolist())
+        self.assertEquals(6.0, np.sum(np.asarray(a, dtype=np.float32)))
+
+    def test030(self):
+        'a numpy scalar on the left behaves like a Python float'
+
+        a = TimeSeries.from_arrays(self.d, [1.0, 2.0, 3.0],
+                                   storage='dict')
+        for left in [np.float64(2), np.float32(2), np.int64(2)]:
+            for current, expected in [(left + a, 2.0 + a),
+                                      (left - a, 2.0 - a),
+                                      (left * a, 2.0 * a)]:
+                self.assertTrue(isinstance(current, TimeSeries))
+                self.assertEquals(expected.get_events(),
+                                  current.get_events())
+            self.assertRaises(TypeError, lambda: 2.0 / a)
+            self.assertRaises(TypeError, lambda: left / a)
+
+
+class TimeSeriesEquality(TestCase):
+    def setUp(self):
+        self.d = [datetime(1979, 3, 15, 9, 35) + timedelta(i)
+                  for i in range(3)]
+
+    def series(self, storage, values=(1.0, 2.0, 3.0), **kwargs):
+        result = TimeSeries(location_id='loc', storage=storage, **kwargs)
+        for d, value in zip(self.d, values):
+            result[d] = (value, 0, '')
+        return result
+
+    def test000(self):
+        'series compare equal across storage engines'
+
+        self.assertEquals(self.series('dict'), self.series('columnar'))
+        self.assertFalse(self.series('dict') != self.series('columnar'))
+
+    def test010(self):
+        'header fields, flags and comments make series differ'
+
+        for storage in ['dict', 'columnar']:
+            a = self.series(storage)
+            self.assertNotEquals(a, self.series(storage, units='m'))
+            b = self.series(storage)
+            b[self.d[1]] = (2.0, 6, '')
+            self.assertNotEquals(a, b)
+            b = self.series(storage)
+            b[self.d[1]] = (2.0, 0, 'comment')
+            self.assertNotEquals(a, b)
+
+    def test020(self):
+        'equals accepts a tolerance on values'
+
+        for storage in ['dict', 'columnar']:
+            a = self.series(storage)
+            b = self.series(storage, values=(1.0, 2.0005, 3.0))
+            self.assertNotEquals(a, b)
+            self.assertTrue(a.equals(b, tolerance=0.001))
+            self.assertFalse(a.equals(b, tolerance=0.0001))
+            inf = float('inf')
+            a = self.series(storage, values=(1.0, inf, -inf))
+            self.assertTrue(a.equals(self.series(storage,
+                                                 values=(1.0, inf, -inf)),
+                                     tolerance=0.001))
+            self.assertFalse(a.equals(self.series(storage,
+                                                  values=(1.0, inf, inf)),
+                                      tolerance=0.001))
+
+    def test030(self):
+        'missing values equal each other'
+
+        for storage in ['dict', 'columnar']:
+            nan = float('nan')
+            self.assertEquals(self.series(storage, values=(1.0, nan, 3.0)),
+                              self.series(storage, values=(1.0, nan, 3.0)))
+
+    def test040(self):
+        'series holding values that are not numbers compare their events'
+
+        a = self.series('dict', values=('a', 'b', 'c'))
+        self.assertEquals(a, self.series('dict', values=('a', 'b', 'c')))
+        self.assertNotEquals(a, self.series('dict', values=('a', 'x', 'c')))
+
+
+class TimeSeriesHeader(TestCase):
+    def test000(self):
+        'identifiers are interned'
+
+        a = TimeSeries(location_id=''.join(['lo', 'c']), units='m')
+        b = TimeSeries(location_id=''.join(['l', 'oc']))
+        self.assertTrue(a.location_id is b.location_id)
+        self.assertFalse(hasattr(a._header, '__dict__'))
+
+    def test010(self):
+        'clones share the header until a field is set'
+
+        a = TimeSeries(location_id='loc', parameter_id='par')
+        b = a.clone()
+        self.assertTrue(a._header is b._header)
+        b.parameter_id = 'other'
+        self.assertEquals('par', a.parameter_id)
+        self.assertEquals('other', b.parameter_id)
+        self.assertEquals('loc', b.location_id)
+        self.assertFalse(a._header is b._header)
+
+    def test020(self):
+        'series survive pickling'
+
+        a = TimeSeries(location_id='loc', parameter_id='par', units='m')
+        a[datetime(1979, 3, 15, 9, 35)] = (1.0, 0, '')
+        for protocol in [0, 2]:
+            self.assertEquals(a, pickle.loads(pickle.dumps(a, protocol)))
+
+
+class TimeSeriesEquidistant(TestCase):
+    def setUp(self):
+        self.testdata = pkg_resources.resource_filename(
+            "timeseries", "testdata/")
+        self.d = [datetime(2010, 4, 2, 23) + timedelta(hours=i)
+                  for i in range(6)]
+
+    def test000(self):
+        'PI series with a time step are read into equidistant storage'
+
+        obj = TimeSeries.as_dict(self.testdata + "read.PI.equidistant.xml")
+        ts = obj[("600", "H.meting")]
+        self.assertEquals('EquidistantEvents', ts._events.__class__.__name__)
+        self.assertEquals(timedelta(hours=1), ts.time_step)
+        reference = TimeSeries.as_dict(
+            self.testdata + "read.PI.equidistant.xml", storage='dict')
+        self.assertEquals(reference[("600", "H.meting")].get_events(),
+                          ts.get_events())
+        self.assertEquals([False, False, True, False, True, False],
+                          ts._events.masked_values().mask.tolist())
+
+    def test010(self):
+        'an event off the grid moves the series to columnar storage'
+
+        obj = TimeSeries.as_dict(self.testdata + "read.PI.equidistant.xml")
+        ts = obj[("601", "H.meting")]
+        self.assertEquals('ColumnarEvents', ts._events.__class__.__name__)
+        self.assertEquals([2.0, 2.5, 3.0],
+                          [v[0] for (k, v) in ts.get_events()])
+
+    def test020(self):
+        'equidistant storage behaves as the other engines'
+
+        a = TimeSeries(storage='equidistant', time_step=timedelta(hours=1))
+        b = TimeSeries(storage='dict', time_step=timedelta(hours=1))
+        for ts in (a, b):
+            for i in (3, 1, 4, 5):
+                ts[self.d[i]] = (i * 0.5, i, '')
+            del ts[self.d[1]]
+            del ts[self.d[5]]
+            ts[self.d[0]] = (7.0, 0, 'first')
+        self.assertEquals(b.get_events(), a.get_events())
+        self.assertEquals(b.get_events(self.d[1], self.d[3]),
+                          a.get_events(self.d[1], self.d[3]))
+        self.assertEquals((self.d[0], self.d[4]),
+                          (a.get_start_date(), a.get_end_date()))
+        self.assertEquals(1.5, a.get_value(self.d[3]))
+        self.assertRaises(KeyError, a.get_value, self.d[2])
+        self.assertTrue(a.equals(b))
+        self.assertEquals(b * 2 + b, a * 2 + a)
+        self.assertEquals(b.filter(value_gt=1.0), a.filter(value_gt=1.0))
+
+    def test030(self):
+        'equidistant series are written with their time step'
+
+        a = TimeSeries(storage='equidistant', time_step=timedelta(hours=1))
+        a[self.d[0]] = 1.0
+        header = a._as_element().find('header')
+        self.assertEquals({'unit': 'second', 'multiplier': '3600'},
+                          header.find('timeStep').attrib)
+        a[self.d[0] + timedelta(minutes=10)] = 2.0
+        header = a._as_element().find('header')
+        self.assertEquals({'unit': 'nonequidistant'},
+                          header.find('timeStep').attrib)
+        a = TimeSeries(storage='equidistant',
+                       time_step=timedelta(milliseconds=1500))
+        a[self.d[0]] = 1.0
+        header = a._as_element().find('header')
+        self.assertEquals({'unit': 'second', 'multiplier': '3',
+                           'divider': '2'},
+                          header.find('timeStep').attrib)
+
+    def test040(self):
+        'equidistant series without a grid use columnar storage'
+
+        d = self.d
+        for events, kwargs in [
+                ({}, {}),
+                ({d[0]: 1.0}, {}),
+                ({d[0]: 1.0, d[1]: 2.0, d[3] + timedelta(minutes=5): 3.0},
+                 {}),
+                ({d[0]: 1.0, d[1] + timedelta(minutes=5): 2.0},
+                 {'time_step': timedelta(hours=1)}),
+                ({d[0]: 1.0, d[0] + timedelta(days=10000): 2.0},
+                 {'time_step': timedelta(hours=1)})]:
+            a = TimeSeries(events, storage='equidistant', **kwargs)
+            self.assertEquals('ColumnarEvents',
+                              a._events.__class__.__name__)
+            self.assertEquals(sorted(events.items()),
+                              [(k, v[0]) for (k, v) in a.get_events()])
+        a = TimeSeries.from_arrays(d[:3:2], [1.0, 2.0],
+                                   storage='equidistant')
+        self.assertEquals(timedelta(hours=2), a._events.step)
+
+    def test050(self):
+        'only series with a time step are read into equidistant storage'
+
+        obj = TimeSeries.as_dict(self.testdata + "read.PI.mixed.xml",
+                                 storage='equidistant')
+        self.assertEquals('EquidistantEvents',
+                          obj['700', 'H.meting']._events.__class__.__name__)
+        self.assertEquals('ColumnarEvents',
+                          obj['701', 'H.meting']._events.__class__.__name__)
+        self.assertEquals([2.0, 2.5, 3.0],
+                          [v[0] for (k, v) in
+                           obj['701', 'H.meting'].get_events()])
+        obj = TimeSeries.as_dict(self.testdata + "read.PI.timezone.2.xml",
+                                 storage='equidistant')
+        self.assertEquals(2, len(obj))
+
+    def test060(self):
+        'resample of equidistant series keeps a fixed grid only per day'
+
+        a = TimeSeries.from_arrays(
+            [datetime(2000, 1, 1) + timedelta(hours=h)
+             for h in range(0, 24 * 70, 6)],
+            np.ones(280), storage='equidistant',
+            time_step=timedelta(hours=6))
+        daily = a.resample('day')
+        self.assertEquals(timedelta(1), daily._events.step)
+        self.assertEquals([4.0] * 70, [v[0] for (k, v) in daily.get_events()])
+        monthly = a.resample('month')
+        self.assertEquals('ColumnarEvents',
+                          monthly._events.__class__.__name__)
+        self.assertEquals([124.0, 116.0, 40.0],
+                          [v[0] for (k, v) in monthly.get_events()])
+
+    def test070(self):
+        'arithmetic with a sparser series keeps the grid of the left one'
+
+        a = TimeSeries.from_arrays(self.d, [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+                                   storage='equidistant',
+                                   time_step=timedelta(hours=1))
+        b = TimeSeries.from_arrays(self.d[::2], [2.0, 2.0, 2.0])
+        for c in [a * b, (a.lazy() * b).evaluate()]:
+            self.assertEquals(timedelta(hours=1), c._events.step)
+            self.assertEquals([(self.d[0], (2.0, 0, '')),
+                               (self.d[2], (6.0, 0, '')),
+                               (self.d[4], (10.0, 0, ''))], c.get_events())
+        c = a * TimeSeries.from_arrays(self.d[1:2], [2.0])
+        self.assertEquals(timedelta(hours=1), c._events.step)
+        self.assertEquals([(self.d[1], (4.0, 0, ''))], c.get_events())
+
+
+class TimeSeriesResample(TestCase):
+    def setUp(self):
+        self.a = TimeSeries.from_arrays(
+            [datetime(1999, 9, 30, 12), datetime(1999, 10, 1, 6),
+             datetime(1999, 10, 1, 18), datetime(1999, 12, 31, 23),
+             datetime(2000, 1, 1)],
+            [1.0, 2.0, float('nan'), 4.0, 8.0], location_id='loc')
+
+    def test000(self):
+        'resample sums per period, placing events at period start'
+
+        self.assertEquals([(datetime(1999, 9, 30), (1.0, 0, '')),
+                           (datetime(1999, 10, 1), (2.0, 0, '')),
+                           (datetime(1999, 12, 31), (4.0, 0, '')),
+                           (datetime(2000, 1, 1), (8.0, 0, ''))],
+                          self.a.resample('day').get_events())
+        self.assertEquals([(datetime(1999, 7, 1), (1.0, 0, '')),
+                           (datetime(1999, 10, 1), (6.0, 0, '')),
+                           (datetime(2000, 1, 1), (8.0, 0, ''))],
+                          self.a.resample('quarter').get_events())
+        self.assertEquals('loc', self.a.resample('month').location_id)
+
+    def test010(self):
+        'resample supports hydrological years and other reductions'
+
+        current = self.a.resample('hydro_year', 'mean')
+        self.assertEquals([(datetime(1998, 10, 1), (1.0, 0, '')),
+                           (datetime(1999, 10, 1), (14.0 / 3, 0, ''))],
+                          current.get_events())
+        self.assertEquals([1.0, 3.0],
+                          [v[0] for (k, v) in self.a.resample(
+                              'hydro_year', 'count').get_events()])
+        self.assertEquals([(datetime(1999, 1, 1), (1.0, 0, '')),
+                           (datetime(2000, 1, 1), (8.0, 0, ''))],
+                          self.a.resample('year', 'min').get_events())
+        self.assertEquals([4.0, 8.0],
+                          [v[0] for (k, v) in self.a.resample(
+                              'year', 'max').get_events()])
+
+    def test020(self):
+        'resample of an empty series is empty'
+
+        self.assertEquals([], TimeSeries().resample('month').get_events())
+
+
+class TimeSeriesRolling(TestCase):
+    def setUp(self):
+        self.a = TimeSeries.from_arrays(
+            [datetime(2000, 1, 1, h) for h in (0, 1, 2, 3, 5, 6)],
+            [3.0, 1.0, float('nan'), 2.0, 5.0, 4.0], location_id='loc')
+
+    def test000(self):
+        'rolling over a number of events needs a full window by default'
+
+        self.assertEquals([(datetime(2000, 1, 1, 1), (4.0, 0, '')),
+                           (datetime(2000, 1, 1, 5), (7.0, 0, '')),
+                           (datetime(2000, 1, 1, 6), (9.0, 0, ''))],
+                          self.a.rolling(2).get_events())
+        self.assertEquals([1.0, 1.0, 1.0, 2.0],
+                          [v[0] for (k, v) in self.a.rolling(
+                              3, 'min', min_count=1).get_events()][1:5])
+        self.assertEquals('loc', self.a.rolling(2).location_id)
+
+    def test010(self):
+        'rolling over a timedelta takes the events in (t - window, t]'
+
+        current = self.a.rolling(timedelta(hours=2), 'max')
+        self.assertEquals([3.0, 3.0, 1.0, 2.0, 5.0, 5.0],
+                          [v[0] for (k, v) in current.get_events()])
+        current = self.a.rolling(timedelta(hours=3), 'mean')
+        self.assertEquals([3.0, 2.0, 2.0, 1.5, 3.5, 4.5],
+                          [v[0] for (k, v) in current.get_events()])
+
+    def test020(self):
+        'rolling agrees with a window by window computation'
+
+        random = np.random.RandomState(1)
+        values = random.rand(200)
+        values[random.rand(200) < 0.2] = np.nan
+        a = TimeSeries.from_arrays(
+            [datetime(2000, 1, 1) + timedelta(hours=h) for h in range(200)],
+            values)
+        for how, func in [('sum', np.nansum), ('min', np.nanmin),
+                          ('max', np.nanmax)]:
+            expected = []
+            for i in range(6, 200):
+                window = values[i - 6:i + 1]
+                if not np.isnan(window).all():
+                    expected.append(func(window))
+            current = [v[0] for (k, v) in a.rolling(7, how, 1).get_events()]
+            self.assertTrue(np.allclose(expected, current[-len(expected):]))
+
+    def test030(self):
+        'rolling_percentile agrees with np.percentile per window'
+
+        current = self.a.rolling_percentile(3, 50, min_count=1)
+        self.assertEquals([3.0, 2.0, 2.0, 1.5, 3.5, 4.0],
+                          [v[0] for (k, v) in current.get_events()])
+        random = np.random.RandomState(2)
+        values = random.rand(150)
+        values[random.rand(150) < 0.2] = np.nan
+        a = TimeSeries.from_arrays(
+            [datetime(2000, 1, 1) + timedelta(hours=h) for h in range(150)],
+            values)
+        current = a.rolling_percentile(timedelta(hours=10), 90)
+        expected = []
+        for i in range(150):
+            window = values[max(0, i - 9):i + 1]
+            window = window[~np.isnan(window)]
+            if len(window):
+                expected.append(np.percentile(window, 90))
+        self.assertTrue(np.allclose(
+            expected, [v[0] for (k, v) in current.get_events()]))
+
+    def test040(self):
+        'rolling rejects a window of less than one event'
+
+        for window in [0, -2, timedelta(0), timedelta(hours=-1)]:
+            self.assertRaises(ValueError, self.a.rolling, window)
+            self.assertRaises(ValueError, self.a.rolling_percentile,
+                              window, 50)
+
+
+class TimeSeriesLazyInput(TestCase):
+    def setUp(self):
+        self.testdata = pkg_resources.resource_filename(
+            "timeseries", "testdata/")
+
+    def test000(self):
+        'as_lazy_dict holds the series of as_dict, read when asked for'
+
+        expected = TimeSeries.as_dict(self.testdata + "read.PI.timezone.2.xml")
+        current = TimeSeries.as_lazy_dict(
+            self.testdata + "read.PI.timezone.2.xml")
+        self.assertEquals(sorted(expected.keys()), sorted(current.keys()))
+        self.assertEquals({}, current._series)
+        key = sorted(expected.keys())[0]
+        self.assertEquals(expected[key].parameter_id,
+                          current.header(key).parameter_id)
+        self.assertEquals([], current.header(key).get_events())
+        self.assertEquals(expected[key], current[key])
+        self.assertEquals([key], current._series.keys())
+        self.assertEquals(expected, dict(current.items()))
+        current.close()
+
+    def test010(self):
+        'as_lazy_dict reads prefixed series and empty files'
+
+        stream = StringIO(
+            '<?xml version="1.0"?>\n'
+            '<pi:TimeSeries xmlns:pi="http://www.wldelft.nl/fews/PI">'
+            '<pi:timeZone>1.0</pi:timeZone>'
+            '<pi:series><pi:header><pi:locationId>a</pi:locationId>'
+            '<pi:parameterId>p</pi:parameterId></pi:header>'
+            '<pi:event date="2010-04-03" time="02:00:00" value="4"/>'
+            '</pi:series >'
+            '</pi:TimeSeries>')
+        current = TimeSeries.as_lazy_dict(stream)
+        self.assertEquals([(datetime(2010, 4, 3, 1), (4.0, 0, ''))],
+                          current['a', 'p'].get_events())
+        self.assertRaises(KeyError, current.__getitem__, ('b', 'p'))
+        self.assertEquals(0, len(TimeSeries.as_lazy_dict(StringIO(''))))
+
+    def test020(self):
+        'as_lazy_dict closes its file when left as a context manager'
+
+        with TimeSeries.as_lazy_dict(
+                self.testdata + "read.PI.timezone.2.xml") as current:
+            self.assertTrue(len(current) > 0)
+        self.assertTrue(current._stream.closed)
+
+    def test030(self):
+        'LazySeriesDict closes the file it opened if it cannot index it'
+
+        streams = []
+
+        class Failing(pilazy.LazySeriesDict):
+            def _index(self):
+                streams.append(self._stream)
+                raise ValueError("not a PI file")
+
+        self.assertRaises(ValueError, Failing,
+                          self.testdata + "read.PI.timezone.2.xml")
+        self.assertTrue(streams[0].closed)
+        stream = StringIO('')
+        self.assertRaises(ValueError, Failing, stream)
+        self.assertFalse(stream.closed)
+
+    def test040(self):
+        'as_lazy_dict names a series without complete header'
+
+        stream = StringIO(
+            '<TimeSeries><series><header><locationId>a</locationId>'
+            '<parameterId>p</parameterId></header></series>'
+            '<series><header><locationId>b</locationId>'
+            '<event date="2010-04-03" time="02:00:00" value="4"/>'
+            '</series></TimeSeries>')
+        try:
+            TimeSeries.as_lazy_dict(stream)
+        except ValueError as e:
+            self.assertTrue('series 2' in str(e))
+        else:
+            self.fail('no ValueError')
+
+    def test050(self):
+        'as_lazy_dict reads streams that can not be mapped'
+
+        expected = TimeSeries.as_dict(self.testdata + "read.PI.timezone.2.xml")
+        content = open(self.testdata + "read.PI.timezone.2.xml", 'rb').read()
+
+        class Unmapped(StringIO):
+            def fileno(self):
+                raise IOError("no file descriptor")
+
+        for stream in [io.BytesIO(content), Unmapped(content)]:
+            current = TimeSeries.as_lazy_dict(stream)
+            self.assertEquals(expected, dict(current.items()))
+
+    def test060(self):
+        'as_lazy_dict passes over series in comments and CDATA'
+
+        content = (
+            '<?xml version="1.0"?>\n'
+            '<!-- <series> before the <root> -->'
+            '<TimeSeries xmlns="http://www.wldelft.nl/fews/PI">'
+            '<!-- <series><header><locationId>old</locationId>'
+            '<parameterId>p</parameterId></header></series> -->'
+            '<series><header><locationId>a</locationId>'
+            '<parameterId>p</parameterId>'
+            '<stationName><![CDATA[</header></series><series>]]>'
+            '</stationName></header>'
+            '<!-- </series> -->'
+            '<event date="2010-04-03" time="02:00:00" value="4"/>'
+            '</series>'
+            '</TimeSeries>')
+        expected = TimeSeries.as_dict(StringIO(content))
+        current = TimeSeries.as_lazy_dict(StringIO(content))
+        self.assertEquals([('a', 'p')], current.keys())
+        self.assertEquals(expected, dict(current.items()))
+        self.assertEquals('</header></series><series>',
+                          current['a', 'p'].station_name)
+
+    def test070(self):
+        'write_to_pi_file writes the series of as_lazy_dict'
+
+        expected = TimeSeries.as_dict(self.testdata + "read.PI.timezone.2.xml")
+        stream = StringIO()
+        with TimeSeries.as_lazy_dict(
+                self.testdata + "read.PI.timezone.2.xml") as current:
+            TimeSeries.write_to_pi_file(stream, current)
+        stream.seek(0)
+        self.assertEquals(expected, TimeSeries.as_dict(stream))
@@ -27,90 +27,25 @@
 #******************************************************************************
 
 import logging
-import itertools
 import timeseries
 
+from bisect import bisect_left
 from copy import deepcopy
 from datetime import datetime
 from datetime import timedelta
-from math import fabs
 
+import numpy as np
+
+from periods import PERIODS
+from periods import period_starts
+from periods import reduce_segments
+from periods import segments
 from timeseries import daily_events
 from timeseries import TimeSeries
 
 logger = logging.getLogger(__name__)
 
 
-def _first_of_day(event):
-    """Return the first moment of the day for an event.
-
-    >>> _first_of_day((datetime(1999, 10, 2, 3, 4), 0.0))
-    datetime.datetime(1999, 10, 2, 0, 0)
-    """
-    date, value = event
-    return datetime(date.year, date.month, date.day)
-
-
-def _first_of_month(event):
-    """Return the first day of the month for an event.
-
-    >>> _first_of_month((datetime(1999, 10, 2, 3, 4), 0.0))
-    datetime.datetime(1999, 10, 1, 0, 0)
-    """
-    date, value = event
-    return datetime(date.year, date.month, 1)
-
-
-def _first_of_quarter(event):
-    """Return the first day of the quarter for an event.
-
-    The first day of a quarter is returned:
-
-      >>> dt = datetime(1972, 12, 25)
-      >>> _first_of_quarter((dt, 'reinout'))
-      datetime.datetime(1972, 10, 1, 0, 0)
-
-      >>> dt = datetime(1972, 10, 1)
-      >>> _first_of_quarter((dt, 'bla'))
-      datetime.datetime(1972, 10, 1, 0, 0)
-
-      >>> dt = datetime(1976, 01, 27)
-      >>> _first_of_quarter((dt, 'maurits'))
-      datetime.datetime(1976, 1, 1, 0, 0)
-
-    """
-    date, value = event
-    month = 1 + ((date.month - 1) / 3 * 3)
-    return datetime(date.year, month, 1)
-
-
-def _first_of_year(event):
-    """Return the first day of the year for an event.
-
-    >>> _first_of_year((datetime(1999, 10, 2, 3, 4), 0.0))
-    datetime.datetime(1999, 1, 1, 0, 0)
-    """
-    date, value = event
-    return datetime(date.year, 1, 1)
-
-
-def _first_of_hydro_year(event):
-    """Return the first day of the year for an event.
-    Hydrologic year starts in October!
-
-    >>> _first_of_hydro_year((datetime(1999, 10, 2, 3, 4), 0.0))
-    datetime.datetime(1999, 10, 1, 0, 0)
-    >>> _first_of_hydro_year((datetime(1999, 9, 2, 3, 4), 0.0))
-    datetime.datetime(1998, 10, 1, 0, 0)
-    """
-    date, value = event
-    if date < datetime(date.year, 10, 1):
-        year = date.year - 1
-    else:
-        year = date.year
-    return datetime(year, 10, 1)
-
-
 def grouped_event_values(timeseries, period, average=False):
     """Return iterator with totals for days/months/years for timeseries.
 
@@ -134,24 +69,21 @@ def grouped_event_values(timeseries, period, average=False):
 
     """
 
-    groupers = {'year': _first_of_year,
-                'month': _first_of_month,
-                'quarter': _first_of_quarter,
-                'day': _first_of_day}
-    grouper = groupers.get(period)
-    assert grouper is not None
-
-    for date, events in itertools.groupby(timeseries.events(), grouper):
-        if average:
-            # To be able to count the events, we make a list of the
-            # generated elements. There are ways to count them without
-            # having to make the list explicit but this is the easy
-            # way.
-            events = list(events)
-            result = (sum(value for (date, value) in events) /
-                      (1.0 * len(events)))
-        else:
-            result = sum(value for (date, value) in events)
+    assert period in PERIODS
+
+    # The periods of all events are computed at once and the values are
+    # summed per period with numpy, see TimeSeries.resample.
+    events = list(timeseries.events())
+    if not events:
+        return
+    dates, values = zip(*events)
+    keys, edges = segments(period_starts(np.array(dates), period))
+    if average:
+        how = 'mean'
+    else:
+        how = 'sum'
+    totals = reduce_segments(values, edges, how)
+    for date, result in zip(keys.astype(object).tolist(), totals.tolist()):
         yield date, result
 
 
@@ -185,24 +117,33 @@ def cumulative_event_values(timeseries, reset_period, period='month',
     if keys.index(reset_period) < keys.index(period):
         period = reset_period
 
-    firsters = {'year': _first_of_year,
-                'hydro_year': _first_of_hydro_year,
-                'month': _first_of_month,
-                'quarter': _first_of_quarter,
-                'day': _first_of_day}
-    reseter = firsters.get(reset_period)
-    assert reseter is not None
+    assert reset_period in PERIODS
+    assert period in PERIODS
 
-    grouper = firsters.get(period)
-    assert grouper is not None
+    events = list(timeseries.events())
+    if not events:
+        return
+    dates, values = zip(*events)
+    dates = np.array(dates)
+    resets = period_starts(dates, reset_period)
+    groups = period_starts(dates, period)
+
+    # A group ends where its own period or the reset period changes. The
+    # values are summed per group, and the group sums are accumulated per
+    # reset period, starting from zero at each reset.
+    changes = np.concatenate(([True], (resets[1:] != resets[:-1]) |
+                                      (groups[1:] != groups[:-1])))
+    edges = np.flatnonzero(changes)
+    sums = np.add.reduceat(np.asarray(values, dtype=np.float64), edges)
+    keys, reset_edges = segments(resets[edges])
+    cumulative = np.empty(len(sums))
+    for start, end in zip(reset_edges, np.append(reset_edges[1:], len(sums))):
+        cumulative[start:end] = np.cumsum(sums[start:end])
 
-    cumulative = 0
     time_shift = timedelta(time_shift)
-    for date, events in itertools.groupby(timeseries.events(), reseter):
-        cumulative = 0
-        for cum_date, cum_events in itertools.groupby(events, grouper):
-            cumulative += sum(value for (date, value) in cum_events)
-            yield (cum_date + time_shift), cumulative * multiply
+    for date, total in zip(groups[edges].astype(object).tolist(),
+                           (cumulative * multiply).tolist()):
+        yield (date + time_shift), total
 
 
 def monthly_events(timeseries):
@@ -265,6 +206,8 @@ class TimeseriesStub(timeseries.TimeSeries):
       list of (date and time, value) tuples ordered by date and time
 
     """
+    lookup_method = 'exact'
+
     def __init__(self, *events):
         if len(events) == 0:
             events = []
@@ -303,13 +246,52 @@ class TimeseriesStub(timeseries.TimeSeries):
 
         """
         result = 0.0
-        events = (event for event in self._events if event[0] >= date_time)
-        event = next(events, None)
-        if not event is None:
-            if event[0] == date_time:
-                result = event[1]
+        index = bisect_left(self._events, (date_time,))
+        if index < len(self._events) and self._events[index][0] == date_time:
+            result = self._events[index][1]
         return result
 
+    def get_values_at(self, date_times, method=None):
+        """Return the values on each of the given dates and times.
+
+        Parameters:
+          *date_times*
+            sequence of dates and times, in any order
+          *method*
+            'exact' for the value of an event on the date and time
+            itself, 'locf' for the value of the latest event on or before
+            it, and 'nearest' for the value of the closest event, the
+            earliest on a tie. It defaults to the lookup of get_value.
+
+        The value is 0.0 where there is no such event. All dates and times
+        are looked up at once by binary search in the events, which are
+        assumed to be ordered earliest date and time first.
+
+        """
+        if method is None:
+            method = self.lookup_method
+        assert method in ('exact', 'locf', 'nearest')
+        keys = np.array(list(date_times), dtype='datetime64[us]')
+        if not self._events:
+            return np.zeros(len(keys))
+        stamps = np.array([event[0] for event in self._events],
+                          dtype='datetime64[us]')
+        values = np.array([event[1] for event in self._events],
+                          dtype=np.float64)
+        index = stamps.searchsorted(keys)
+        after = index.clip(0, len(stamps) - 1)
+        before = (index - 1).clip(0)
+        exact = (index < len(stamps)) & (stamps[after] == keys)
+        if method == 'exact':
+            return np.where(exact, values[after], 0.0)
+        if method == 'locf':
+            return np.where(exact, values[after],
+                            np.where(index > 0, values[before], 0.0))
+        ## nearest: the earlier event unless the later one is closer
+        later = (index < len(stamps)) & (
+            (index == 0) | (stamps[after] - keys < keys - stamps[before]))
+        return np.where(later, values[after], values[before])
+
     def add_value(self, date_time, value):
         """Add the given value for the given date and time.
 
@@ -368,18 +350,76 @@ class TimeseriesStub(timeseries.TimeSeries):
 
     def __eq__(self, other):
         """Return True iff the two given time series represent the
-        same events."""
-        my_events = list(self.events())
-        your_events = list(other.events())
-        equal = len(my_events) == len(your_events)
-        if equal:
-            for (my_event, your_event) in zip(my_events, your_events):
-                equal = my_event[0] == your_event[0]
-                if equal:
-                    equal = fabs(my_event[1] - your_event[1]) < 1e-6
-                if not equal:
-                    break
-        return equal
+        same events.
+
+        Values are considered the same when they differ less than 1e-6.
+
+        """
+        return self.equals(other)
+
+    def equals(self, other, tolerance=1e-6):
+        """Return True iff the two given time series represent the
+        same events, with values that differ less than tolerance.
+
+        The sorted dates and values of both time series are compared as
+        arrays, at the dates of either. A date that one of them lacks
+        has value 0 when events fills it in, that is, when it lies
+        between two events and a whole number of days after the first
+        of them; otherwise the two time series differ. No event is left
+        out, so an event with value 0 on any other date, or values on
+        both sides that are each close to 0 but not to each other, still
+        make a difference: tolerance only applies to the values
+        compared at the same date.
+
+        """
+        my_dates, my_values = _sorted_events(self)
+        your_dates, your_values = _sorted_events(other)
+        dates = np.union1d(my_dates, your_dates)
+        differences = (_filled_values(my_dates, my_values, dates) -
+                       _filled_values(your_dates, your_values, dates))
+        with np.errstate(invalid='ignore'):
+            return bool((abs(differences) < tolerance).all())
+
+    def _stored_events(self):
+        """Return the (date and time, value) pairs that events fills in
+        with value 0.
+
+        """
+        return self._events
+
+
+def _sorted_events(timeseries):
+    """Return the sorted date and value arrays of the given timeseries."""
+    if hasattr(timeseries, '_stored_events'):
+        events = timeseries._stored_events()
+    else:
+        events = list(timeseries.events())
+    dates = np.array([event[0] for event in events], dtype='datetime64[us]')
+    values = np.array([event[1] for event in events], dtype=np.float64)
+    order = dates.argsort(kind='mergesort')
+    return dates[order], values[order]
+
+
+def _filled_values(dates, values, at):
+    """Return the values of the sorted events at the given dates.
+
+    A date without event has value 0 when events fills it in, and nan
+    otherwise, so that it differs from any value.
+
+    """
+    result = np.empty(len(at))
+    result.fill(np.nan)
+    if not len(dates):
+        return result
+    index = dates.searchsorted(at)
+    found = (index < len(dates)) & (dates[index.clip(0, len(dates) - 1)] == at)
+    result[found] = values[index[found]]
+    inner = ~found & (index > 0) & (index < len(dates))
+    steps = (at[inner].view(np.int64) -
+             dates[index[inner] - 1].view(np.int64))
+    filled = np.flatnonzero(inner)[steps % (86400 * 10 ** 6) == 0]
+    result[filled] = 0.0
+    return result
 
 
 class SparseTimeseriesStub(timeseries.TimeSeries):
@@ -486,6 +526,8 @@ class SparseTimeseriesStub(timeseries.TimeSeries):
 
 class TimeseriesWithMemoryStub(TimeseriesStub):
 
+    lookup_method = 'locf'
+
     def __init__(self, *args, **kwargs):
         TimeseriesStub.__init__(self, *args, **kwargs)
 
@@ -497,20 +539,20 @@ class TimeseriesWithMemoryStub(TimeseriesStub):
 
         """
         result = 0.0
-        previous_event = None
-        # note that we traverse the list of events in reverse
-        for event in reversed(self._events):
-            if event[0] < date_time:
-                if previous_event is None:
-                    result = event[1]
-                else:
-                    result = previous_event[1]
-                break
-            elif event[0] == date_time:
-                result = event[1]
-                previous_event = event
+        index = bisect_left(self._events, (date_time,))
+        if index < len(self._events) and self._events[index][0] == date_time:
+            result = self._events[index][1]
+        elif index > 0:
+            result = self._events[index - 1][1]
         return result
 
+    def _stored_events(self):
+        """Return the daily events, as missing dates are not filled in
+        with value 0.
+
+        """
+        return list(self.events())
+
     def events(self, start_date=None, end_date=None):
         """Return a generator to iterate over all daily events.
 
@@ -573,6 +615,10 @@ class TimeseriesRestrictedStub(TimeseriesStub):
             end_date = self.end_date
         return end_date
 
+    def _stored_events(self):
+        """Return the events of the restricted time series."""
+        return list(self.events())
+
     def events(self, start_date=None, end_date=None):
         """Return a generator to iterate over the requested events.
 
@@ -42,6 +42,7 @@ from timeseriesstub import TimeseriesWithMemoryStub
 from timeseriesstub import add_timeseries
 from timeseriesstub import average_monthly_events
 from timeseriesstub import create_empty_timeseries
+from timeseriesstub import cumulative_event_values
 from timeseriesstub import enumerate_events
 from timeseriesstub import map_timeseries
 from timeseriesstub import multiply_timeseries
@@ -213,6 +214,79 @@ class TimeseriesStubTestSuite(TestCase):
         events = list(map_timeseries(timeseries, map_function).events())
         self.assertEqual(expected_events, events)
 
+    def test_m(self):
+        """Test equality tolerates differences below 1e-6."""
+        timeseries = TimeseriesStub((datetime(2011, 7, 6), 10),
+                                    (datetime(2011, 7, 8), 30))
+        self.assertEqual(timeseries,
+                         TimeseriesStub((datetime(2011, 7, 6), 10.0000001),
+                                        (datetime(2011, 7, 8), 30)))
+        self.assertNotEqual(timeseries,
+                            TimeseriesStub((datetime(2011, 7, 6), 10.001),
+                                           (datetime(2011, 7, 8), 30)))
+        self.assertNotEqual(timeseries,
+                            TimeseriesStub((datetime(2011, 7, 6), 10),
+                                           (datetime(2011, 7, 9), 30)))
+
+    def test_p(self):
+        """Test equality counts genuine zero-valued events."""
+        timeseries = TimeseriesStub((datetime(2011, 7, 6), 10),
+                                    (datetime(2011, 7, 9), 30))
+        self.assertNotEqual(timeseries,
+                            TimeseriesStub((datetime(2011, 7, 6), 10),
+                                           (datetime(2011, 7, 9), 30),
+                                           (datetime(2011, 7, 10), 0)))
+        self.assertNotEqual(TimeseriesStub((datetime(2011, 7, 6), 10),
+                                           (datetime(2011, 7, 7), 9e-7),
+                                           (datetime(2011, 7, 9), 30)),
+                            TimeseriesStub((datetime(2011, 7, 6), 10),
+                                           (datetime(2011, 7, 7), -9e-7),
+                                           (datetime(2011, 7, 9), 30)))
+        self.assertNotEqual(TimeseriesWithMemoryStub((datetime(2011, 7, 6),
+                                                      10),
+                                                     (datetime(2011, 7, 8),
+                                                      10)),
+                            TimeseriesStub((datetime(2011, 7, 6), 10),
+                                           (datetime(2011, 7, 7), 0),
+                                           (datetime(2011, 7, 8), 10)))
+
+    def test_n(self):
+        """Test equality takes an explicit tolerance."""
+        timeseries = TimeseriesStub((datetime(2011, 7, 6), 10),
+                                    (datetime(2011, 7, 8), 30))
+        other = TimeseriesStub((datetime(2011, 7, 6), 10.001),
+                               (datetime(2011, 7, 8), 30))
+        self.assertTrue(timeseries.equals(other, tolerance=0.01))
+        self.assertFalse(timeseries.equals(other, tolerance=0.0001))
+
+    def test_o(self):
+        """Test equality takes missing dates as events with value 0."""
+        timeseries = TimeseriesStub((datetime(2011, 7, 6), 10),
+                                    (datetime(2011, 7, 9), 30))
+        self.assertEqual(timeseries,
+                         TimeseriesStub((datetime(2011, 7, 6), 10),
+                                        (datetime(2011, 7, 7), 0),
+                                        (datetime(2011, 7, 8), 1e-7),
+                                        (datetime(2011, 7, 9), 30)))
+        self.assertNotEqual(timeseries,
+                            TimeseriesStub((datetime(2011, 7, 6), 10),
+                                           (datetime(2011, 7, 7, 12), 0),
+                                           (datetime(2011, 7, 9), 30)))
+        self.assertNotEqual(timeseries,
+                            TimeseriesStub((datetime(2011, 7, 5), 0),
+                                           (datetime(2011, 7, 6), 10),
+                                           (datetime(2011, 7, 9), 30)))
+        self.assertEqual(TimeseriesStub((datetime(2011, 7, 6), 10),
+                                        (datetime(2011, 7, 9), 0)),
+                         TimeseriesStub((datetime(2011, 7, 6), 10),
+                                        (datetime(2011, 7, 8), 0),
+                                        (datetime(2011, 7, 9), 0)))
+        self.assertEqual(TimeseriesWithMemoryStub((datetime(2011, 7, 6), 10),
+                                                  (datetime(2011, 7, 8), 10)),
+                         TimeseriesStub((datetime(2011, 7, 6), 10),
+                                        (datetime(2011, 7, 7), 10),
+                                        (datetime(2011, 7, 8), 10)))
+
 
 class SparseTimeseriesStubTests(TestCase):
 
@@ -323,6 +397,54 @@ class SparseTimeseriesStubTests(TestCase):
         self.assertEqual((datetime(2011, 4, 9), 20.0), events[0])
         self.assertEqual((datetime(2011, 4, 10), 30.0), events[1])
 
+    def test_i(self):
+        """Test two time series with the same events are equal."""
+        timeseries = SparseTimeseriesStub(datetime(2011, 4, 8), [10.0, 20.0])
+        self.assertEqual(SparseTimeseriesStub(datetime(2011, 4, 8),
+                                              [10.0, 20.0]), timeseries)
+        self.assertNotEqual(SparseTimeseriesStub(datetime(2011, 4, 8),
+                                                 [10.0, 30.0]), timeseries)
+        self.assertEqual(SparseTimeseriesStub(), SparseTimeseriesStub())
+
+
+class cumulative_event_values_Tests(TestCase):
+
+    def setUp(self):
+        self.timeserie = TimeseriesStub((datetime(2010, 9, 29), 10),
+                                        (datetime(2010, 10, 2), 20),
+                                        (datetime(2010, 11, 30), 30),
+                                        (datetime(2011, 1, 1), 40))
+
+    def test_a(self):
+        """Test the cumulative monthly values reset each hydrological
+        year."""
+        events = list(cumulative_event_values(self.timeserie, 'hydro_year'))
+        self.assertEqual([(datetime(2010, 9, 1), 10.0),
+                          (datetime(2010, 10, 1), 20.0),
+                          (datetime(2010, 11, 1), 50.0),
+                          (datetime(2010, 12, 1), 50.0),
+                          (datetime(2011, 1, 1), 90.0)], events)
+
+    def test_b(self):
+        """Test the reset period is used when it is smaller than the group
+        period, together with multiply and time_shift."""
+        events = list(cumulative_event_values(self.timeserie, 'month',
+                                              period='year', multiply=2,
+                                              time_shift=1))
+        self.assertEqual([(datetime(2010, 9, 2), 20.0),
+                          (datetime(2010, 10, 2), 40.0),
+                          (datetime(2010, 11, 2), 60.0),
+                          (datetime(2010, 12, 2), 0.0),
+                          (datetime(2011, 1, 2), 80.0)], events)
+
+    def test_c(self):
+        """Test a yearly group period within a hydrological reset period."""
+        events = list(cumulative_event_values(self.timeserie, 'year',
+                                              period='hydro_year'))
+        self.assertEqual([(datetime(2009, 10, 1), 10.0),
+                          (datetime(2010, 10, 1), 60.0),
+                          (datetime(2010, 10, 1), 40.0)], events)
+
 
 class average_monthly_events_Tests(TestCase):
 
@@ -409,6 +531,29 @@ class TimeseriesWithMemoryTests(TestCase):
             [(today, 20), (tomorrow, 20), (day_after_tomorrow, 30)]
         self.assertEqual(expected_events, events)
 
+    def test_e(self):
+        """Test an exact date & time takes its first value."""
+        today = datetime(2010, 12, 20)
+        timeserie = TimeseriesWithMemoryStub((today, 20.0), (today, 25.0),
+                                             (today + timedelta(2), 30.0))
+        self.assertAlmostEqual(20.0, timeserie.get_value(today))
+        self.assertAlmostEqual(0.0, timeserie.get_value(today - timedelta(1)))
+
+    def test_f(self):
+        """Test the values of a batch of dates & times by each method."""
+        today = datetime(2010, 12, 20)
+        timeserie = TimeseriesWithMemoryStub((today, 20.0),
+                                             (today + timedelta(3), 30.0))
+        date_times = [today + timedelta(days) for days in (2, -1, 0, 1, 5)]
+        self.assertEqual([20.0, 0.0, 20.0, 20.0, 30.0],
+                         list(timeserie.get_values_at(date_times)))
+        self.assertEqual([0.0, 0.0, 20.0, 0.0, 0.0],
+                         list(timeserie.get_values_at(date_times, 'exact')))
+        self.assertEqual([30.0, 20.0, 20.0, 20.0, 30.0],
+                         list(timeserie.get_values_at(date_times, 'nearest')))
+        self.assertEqual([0.0, 0.0],
+                         list(TimeseriesStub().get_values_at(date_times[:2])))
+
 
 class TimeseriesStubRestrictedTest(TestCase):
 
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+
+"""trailing (rolling) windows over arrays of values
+
+a window is given per position by the index where it starts: the
+window of position i holds the values from `starts[i]` up to and
+including i.  as `starts` never decreases, sums and means are taken
+from cumulative sums and minimums and maximums from a monotonic
+deque, so that the cost is linear in the number of values whatever
+the width of the window.  percentiles keep the window split in two
+heaps, at a cost logarithmic in the width of the window per value.
+
+missing (nan) values are left out of every window.
+"""
+
+from collections import deque
+import heapq
+
+import numpy as np
+
+
+HOW = ('sum', 'mean', 'min', 'max', 'count')
+
+
+def starts_by_count(size, width):
+    """return the window starts of `width` consecutive positions
+
+    >>> starts_by_count(5, 3).tolist()
+    [0, 0, 0, 1, 2]
+    """
+
+    assert width >= 1
+    return np.maximum(np.arange(size) - (width - 1), 0)
+
+
+def starts_by_duration(stamps, duration):
+    """return the window starts of the trailing `duration`
+
+    `stamps` are sorted, `duration` is in the same unit as `stamps`.
+    the window of a stamp t holds the stamps in (t - duration, t].
+
+    >>> starts_by_duration(np.array([0, 1, 2, 5, 6]), 3).tolist()
+    [0, 0, 0, 3, 3]
+    """
+
+    assert duration > 0
+    stamps = np.asarray(stamps)
+    return np.searchsorted(stamps, stamps - duration, side='right')
+
+
+def rolling(values, starts, how='sum', min_count=1):
+    """return `how` of `values` over the windows beginning at `starts`
+
+    `how` is one of 'sum', 'mean', 'min', 'max' and 'count'.  the
+    result is nan where a window holds less than `min_count` values.
+
+    >>> values = np.array([1.0, 2.0, np.nan, 4.0, 3.0])
+    >>> rolling(values, starts_by_count(5, 2), 'sum').tolist()
+    [1.0, 3.0, 2.0, 4.0, 7.0]
+    >>> rolling(values, starts_by_count(5, 2), 'max', min_count=2)[-1]
+    4.0
+    """
+
+    assert how in HOW
+    values = np.asarray(values, dtype=np.float64)
+    starts = np.asarray(starts, dtype=np.intp)
+    ends = np.arange(1, len(values) + 1)
+    missing = np.isnan(values)
+    counts = np.concatenate(([0], np.cumsum(~missing)))
+    counts = counts[ends] - counts[starts]
+    if how == 'count':
+        result = counts.astype(np.float64)
+    elif how in ('sum', 'mean'):
+        sums = np.concatenate(([0.0], np.cumsum(np.where(missing, 0.0,
+                                                         values))))
+        result = sums[ends] - sums[starts]
+        if how == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result = result / counts
+    else:
+        result = _rolling_extreme(values, missing, starts, how == 'min')
+    result[counts < min_count] = np.nan
+    return result
+
+
+def _rolling_extreme(values, missing, starts, minimum):
+    """return the minimum or maximum over each window
+
+    the deque holds the positions of the candidates of the current
+    window, with their values in increasing (minimum) or decreasing
+    (maximum) order, so its front is the extreme of the window.
+    """
+
+    result = np.empty(len(values))
+    result.fill(np.nan)
+    values = values.tolist()
+    missing = missing.tolist()
+    starts = starts.tolist()
+    candidates = deque()
+    for i, value in enumerate(values):
+        if not missing[i]:
+            if minimum:
+                while candidates and values[candidates[-1]] >= value:
+                    candidates.pop()
+            else:
+                while candidates and values[candidates[-1]] <= value:
+                    candidates.pop()
+            candidates.append(i)
+        while candidates and candidates[0] < starts[i]:
+            candidates.popleft()
+        if candidates:
+            result[i] = values[candidates[0]]
+    return result
+
+
+def rolling_percentile(values, starts, percentile, min_count=1):
+    """return the `percentile` of `values` over the windows at `starts`
+
+    `percentile` is in [0, 100] and interpolated linearly between the
+    two nearest values of the window, as by `np.percentile`.  the
+    result is nan where a window holds less than `min_count` values.
+
+    >>> values = np.array([5.0, 1.0, np.nan, 3.0, 2.0, 4.0])
+    >>> rolling_percentile(values, starts_by_count(6, 3), 50).tolist()
+    [5.0, 3.0, 3.0, 2.0, 2.5, 3.0]
+    """
+
+    assert 0 <= percentile <= 100
+    fraction = percentile / 100.0
+    values = np.asarray(values, dtype=np.float64)
+    result = np.empty(len(values))
+    result.fill(np.nan)
+    missing = np.isnan(values).tolist()
+    starts = np.asarray(starts).tolist()
+    values = values.tolist()
+
+    ## the window is split in the `lower` values, a max-heap of
+    ## (-value, position), and the `upper` values, a min-heap of
+    ## (value, position): every lower value is at most every upper
+    ## value.  values leaving the window are only marked as expired,
+    ## and dropped once they reach the top of their heap.
+    lower, upper = [], []
+    in_lower = [False] * len(values)
+    expired = [False] * len(values)
+    sizes = [0, 0]  # lower, upper, not counting expired values
+    start = 0
+
+    def prune(heap):
+        while heap and expired[heap[0][1]]:
+            heapq.heappop(heap)
+
+    for i, value in enumerate(values):
+        for j in range(start, starts[i]):
+            if not missing[j]:
+                expired[j] = True
+                sizes[not in_lower[j]] -= 1
+        start = max(start, starts[i])
+        if not missing[i]:
+            prune(lower)
+            if lower and value < -lower[0][0]:
+                heapq.heappush(lower, (-value, i))
+                in_lower[i] = True
+                sizes[0] += 1
+            else:
+                heapq.heappush(upper, (value, i))
+                sizes[1] += 1
+        count = sizes[0] + sizes[1]
+        if not count or count < min_count:
+            continue
+
+        ## the lower heap holds the values up to the one at `rank`
+        rank, weight = divmod((count - 1) * fraction, 1)
+        wanted = int(rank) + 1
+        while sizes[0] > wanted:
+            prune(lower)
+            item, j = heapq.heappop(lower)
+            heapq.heappush(upper, (-item, j))
+            in_lower[j] = False
+            sizes[0] -= 1
+            sizes[1] += 1
+        while sizes[0] < wanted:
+            prune(upper)
+            item, j = heapq.heappop(upper)
+            heapq.heappush(lower, (-item, j))
+            in_lower[j] = True
+            sizes[0] += 1
+            sizes[1] -= 1
+        prune(lower)
+        result[i] = -lower[0][0]
+        if weight:
+            prune(upper)
+            result[i] += (upper[0][0] - result[i]) * weight
+    return result